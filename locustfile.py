@@ -1,20 +1,79 @@
 import json
 from datetime import datetime
-from locust import HttpUser, task, between, events, User
+from locust import HttpUser, FastHttpUser, LoadTestShape, SequentialTaskSet, TaskSet, task, between, constant, events
+from locust.contrib.fasthttp import FastResponse
+from locust.clients import LocustHttpAdapter
+from locust.exception import CatchResponseError, StopUser
+from locust.runners import STATE_RUNNING, STATE_SPAWNING, MasterRunner, WorkerRunner
 @events.init_command_line_parser.add_listener
 def add_test_type_option(parser):
     parser.add_argument("--test-type", type=str, default="api", help="Test type: 'api' or 'client'")
-import requests
+    parser.add_argument("--client-backend", type=str, default="requests", choices=["requests", "fast"],
+                        help="HTTP client for collection requests: 'requests' (HttpUser) or 'fast' (FastHttpUser)")
+    parser.add_argument("--response-mode", type=str, default="full", choices=["full", "drain"],
+                        help="'full' buffers every response body, 'drain' streams successful bodies without decoding them")
+    parser.add_argument("--request-name-mode", type=str, default="path", choices=["path", "template", "item"],
+                        help="Stats name of collection requests: resolved 'path', path 'template' or Postman 'item' name")
+    parser.add_argument("--max-request-names", type=int, default=200,
+                        help="Distinct request names before further requests are grouped as 'other'")
+    parser.add_argument("--arrival-rate", type=float, default=0,
+                        help="Open model: total collection requests per second, -u caps concurrent requests")
+    parser.add_argument("--arrival-stages", type=str, default="",
+                        help="Open model ramp as 'seconds:rate,...', each stage ramps from the previous rate in 1 second steps")
+    parser.add_argument("--slo-file", type=str, default="",
+                        help="Capacity search: JSON file with p95/p99/error_rate SLOs, steps users up until one breaks")
+    parser.add_argument("--step-users", type=int, default=50,
+                        help="Capacity search: users added per step, -u is the upper bound")
+    parser.add_argument("--step-time", type=int, default=60,
+                        help="Capacity search: seconds each step is held and measured")
+    parser.add_argument("--feeder", type=str, default="",
+                        help="CSV (with header) or JSONL file whose columns fill {{column}} placeholders, one row per request")
+    parser.add_argument("--feeder-mode", choices=["sequential", "random", "unique"], default="sequential",
+                        help="Row order: file order with wrap-around, random, or every row once")
+    parser.add_argument("--feeder-partition", type=str, default="",
+                        help="Worker only: read the INDEX/COUNT slice of the feeder instead of the one the master assigns")
+    parser.add_argument("--task-order", choices=["random", "sequential"], default="random",
+                        help="Pick collection requests at random, or run each folder in order as a flow")
+    parser.add_argument("--bench-report", type=str, default="",
+                        help="Generator benchmark: users send back to back, CPU/RSS/spawn metrics are written to this JSON file")
+    parser.add_argument("--profile-phases", action="store_true",
+                        help="Time templating, request, body, checks and error bookkeeping of every task per request name")
+    parser.add_argument("--profile-sample", type=str, default="",
+                        help="Also sample CPU stacks during the run and save them as flamegraph folded stacks to this file")
+    parser.add_argument("--request-log", type=str, default="",
+                        help="Write every request (time, name, status, latency, bytes) to this binary file, see 'postmantolocust.py request-log'")
+    parser.add_argument("--request-log-sample", type=float, default=1.0,
+                        help="Fraction of requests written to the request log")
+    parser.add_argument("--latency-histograms", type=str, default="",
+                        help="Keep an HDR latency histogram per request name and save them to this JSON file at stop")
+    parser.add_argument("--failure-body-limit", type=int, default=2048,
+                        help="Maximum bytes of a failed response body kept in error messages")
 import os
 import sys
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import re
 import logging
+import csv
+import hashlib
+import mmap
+import importlib.util
+import random
+import zlib
+import signal
+import struct
+from bisect import bisect_left
+import psutil
 from configparser import ConfigParser
+from urllib.parse import urlparse, urljoin, quote, quote_plus
+from html.parser import HTMLParser
+from email.utils import parsedate_to_datetime
 
 # Prometheus metrics exporter
 from flask import Response
-import threading
+import gevent
+from gevent.event import Event
+from gevent.pool import Pool
+from gevent.queue import Queue
 import time
 
 # Config dosyasını oku
@@ -22,19 +81,128 @@ config = ConfigParser()
 config.read('locust.conf')
 TEST_TYPE = config.get('settings', 'test-type', fallback='api')
 
+def get_setting(name, default):
+    """ Reads a [settings] value, letting an explicit --name command line argument override it """
+    # User classes are picked at import time, before locust parses the command line
+    option = f"--{name}"
+    for index, arg in enumerate(sys.argv):
+        if arg == option and index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+        if arg.startswith(f"{option}="):
+            return arg.split('=', 1)[1]
+    return config.get('settings', name, fallback=default).split(';')[0].strip()
+
+if any(arg == '--test-type' or arg.startswith('--test-type=') for arg in sys.argv):
+    # An explicit --test-type also decides the user class, which is picked at import time
+    TEST_TYPE = get_setting('test-type', TEST_TYPE)
+
+CLIENT_BACKEND = get_setting('client-backend', 'requests')
+
+# Open model (arrival rate) settings, read at import time because they decide the load shape
+ARRIVAL_RATE = float(get_setting('arrival-rate', '0') or 0)
+ARRIVAL_STAGES = get_setting('arrival-stages', '')
+ARRIVAL_DEFAULT_USERS = 100  # Concurrent request cap when -u is not given
+ARRIVAL_LATE_THRESHOLD = 0.01  # Seconds behind schedule before a start counts as late
+ARRIVAL_IDLE_SLEEP = 0.1  # Longest nap of the schedule greenlet before it re-checks the rate
+ARRIVAL_MAX_BACKLOG = 5  # Seconds of slots at the current rate kept waiting, later arrivals are dropped
+
+# Capacity search: step users up until an endpoint breaks its SLO
+SLO_FILE = get_setting('slo-file', '')
+SLO_KEYS = {'p95', 'p99', 'error_rate'}  # Latencies in seconds, error rate as a fraction
+CAPACITY_STEP_USERS = 50  # Users added per step when --step-users is not given
+CAPACITY_STEP_TIME = 60  # Seconds per step when --step-time is not given
+CAPACITY_MIN_SAMPLES = 20  # Requests an endpoint needs in the step window before its SLO is judged
+CAPACITY_MAX_STEP_STRETCH = 4  # A step window runs up to this many step times while SLO endpoints lack samples
+CAPACITY_REPORT_FILE = 'Locust_Report/capacity_report.json'
+
+# Feeders: {{column}} placeholders filled from CSV/JSONL rows at send time
+FEEDER_RELEASE_BYTES = 64 * 1024 * 1024  # Rows read between dropping the mapped file pages from RSS
+FEEDER_MAX_BLANK_LINES = 1000  # Consecutive blank lines skipped before the feeder gives up
+
 # Locust Configurations
 MAX_RESPONSE_TIME = 90
 COLLECTION_FILE_NAME = 'Collections/RAC-TEST.postman_collection.json'
+COMPILED_DIR = 'Collections/compiled'  # Modules generated by `python postmantolocust.py compile`
+COMPILER_VERSION = 5  # Bump when generated modules change shape, so cached ones are not imported
 LOG_FILE = 'locust.log'
 
-# Configure logging
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    filemode='w'  # 'w' mode overwrites the file on each run
+# Request names, bounded so stats, CSV reports and /metrics labels stay small
+MAX_REQUEST_NAMES = 200
+TEMPLATE_HOST_PATTERN = re.compile(r'^(?:\{\{\w+\}\}|https?://[^/]+)')
+TEMPLATE_ID_PATTERN = re.compile(r'\d')
+TEMPLATE_VERSION_PATTERN = re.compile(r'v\d+')
+
+# Error summary memory budget
+ERROR_SUMMARY_MAX_FINGERPRINTS = 200  # Distinct (method, name, status, body prefix) kept before folding into <other>
+ERROR_SUMMARY_SAMPLES = 3  # Sample bodies kept per fingerprint
+ERROR_SAMPLE_SIZE = 512  # Characters kept per sample body
+ERROR_FINGERPRINT_SIZE = 64  # Characters of normalized body used in the fingerprint
+ERROR_VOLATILE_PATTERN = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F-]{27}|\d+')
+
+# Opt-in client overhead profiler (--profile-phases)
+PHASES = ('template', 'request', 'body', 'checks', 'error_body', 'error_bookkeeping', 'report')
+PHASE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+PHASE_BUCKETS_NS = tuple(int(bound * 1e9) for bound in PHASE_BUCKETS)
+PROFILE_SUMMARY_NAMES = 10  # Request names printed in the phase summary
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds of process CPU time between stack samples
+
+# Client test type: browser-like page loads
+ASSET_CONCURRENCY = 6  # Parallel asset fetches per user, browsers open about 6 connections per host
+ASSET_POOL_HOSTS = 10  # Hosts a user keeps keep-alive connection pools for
+ASSET_CACHE_ENTRIES = 500  # URLs kept in each user's HTTP cache
+ASSET_TAGS = {'link', 'script', 'img', 'base'}
+ASSET_LINK_RELS = {'stylesheet', 'icon', 'shortcut', 'preload', 'modulepreload', 'apple-touch-icon'}
+STATIC_RESOURCES = (
+    "/static/css/main.css",
+    "/static/js/app.js",
+    "/static/images/logo.png"
 )
 
+# Per-request log (--request-log): length-prefixed frames of fixed size records
+REQUEST_LOG_MAGIC = b'LRQLOG'
+REQUEST_LOG_VERSION = 1
+REQUEST_LOG_FRAME = struct.Struct('<cI')  # Frame kind (H header, N names, R records) and payload length
+REQUEST_RECORD = struct.Struct('<dfIIH?')  # Start time, latency ms, bytes, name id, status, failed
+REQUEST_LOG_BATCH = 8192  # Records per buffer handed to the writer
+REQUEST_LOG_PENDING = 64  # Batches queued for the writer before new ones are dropped
+REQUEST_LOG_FLUSH_INTERVAL = 1.0  # Seconds between writes of partially filled buffers
+
+# Mergeable latency histograms (--latency-histograms), compared with `python postmantolocust.py compare`
+LATENCY_HISTOGRAM_VERSION = 1
+LATENCY_SIGNIFICANT_BITS = 7  # 128 buckets per power of two, under 0.8% relative error
+
+METRICS_CACHE_TTL = 2.0  # Seconds a rendered /metrics page is reused
+LOOP_LAG_INTERVAL = 0.1  # Seconds between gevent loop lag probes
+
+LOG_FORMAT = '[%(asctime)s] %(levelname)s: %(message)s'
+
+@events.init.add_listener
+def on_log_file_init(environment, **kwargs):
+    """ Starts LOG_FILE next to locust's own logging, only when locust loads this file and not on CLI imports """
+    handler = logging.FileHandler(LOG_FILE, mode='w')  # 'w' mode overwrites the file on each run
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.setLevel(logging.INFO)
+    logging.getLogger().addHandler(handler)
+
+# Placeholder values that never change during a run
+STATIC_PLACEHOLDERS = {
+    "<integer>": "123",
+    "<id>": "123",
+    "<string>": "example_string",
+    "<boolean>": "true",
+    "<array>": "[]",
+    "<object>": "{}",
+    "<double>": "12.34",
+}
+
+# Placeholder values that must be produced at send time
+DYNAMIC_PLACEHOLDERS = {
+    "<dateTime>": lambda: datetime.now().isoformat(),
+}
+
+UNKNOWN_PLACEHOLDER_PATTERN = re.compile(r'<[^>]+>')
+
 def replace_placeholders(data):
     """ Replaces placeholder values with appropriate data types """
     if isinstance(data, dict):
@@ -42,19 +210,12 @@ def replace_placeholders(data):
     elif isinstance(data, list):
         return [replace_placeholders(item) for item in data]
     elif isinstance(data, str):
-        placeholders = {
-            "<integer>": "123",
-            "<id>": "123",
-            "<string>": "example_string",
-            "<boolean>": "true",
-            "<array>": "[]",
-            "<object>": "{}",
-            "<double>": "12.34",
-            "<dateTime>": datetime.now().isoformat()
-        }
-        for placeholder, value in placeholders.items():
+        for placeholder, value in STATIC_PLACEHOLDERS.items():
             data = data.replace(placeholder, value)
-        return re.sub(r'<[^>]+>', '333', data)
+        for placeholder, factory in DYNAMIC_PLACEHOLDERS.items():
+            if placeholder in data:
+                data = data.replace(placeholder, factory())
+        return UNKNOWN_PLACEHOLDER_PATTERN.sub('333', data)
     return data
 
 def replace_path_variables(url, headers, url_variables):
@@ -88,50 +249,663 @@ def replace_path_variables(url, headers, url_variables):
     
     return url
 
-def parse_json(raw_body):
-    """ Processes JSON body and replaces placeholders with appropriate data types """
+# Send-time slots are marked with private-use characters so they survive json.dumps
+SLOT_OPEN, SLOT_CLOSE = '\ue000', '\ue001'
+# Feeder columns used as bare JSON values ("id": {{id}}) are quoted first so the body still parses
+RAW_OPEN, RAW_CLOSE = '\ue002', '\ue003'
+JSON_SLOT_PATTERN = re.compile(r'\\ue000(\d+)\\ue001|"\\ue002(\d+)\\ue003"')
+TEXT_SLOT_PATTERN = re.compile(f'{SLOT_OPEN}(\\d+){SLOT_CLOSE}')
+RAW_SLOT_PATTERN = re.compile(f'{RAW_OPEN}(\\{{\\{{\\w+\\}}\\}}){RAW_CLOSE}')
+BARE_COLUMN_PATTERN = re.compile(r'(?<=[:\[,])(\s*)\{\{(\w+)\}\}(?=\s*[,}\]])')
+FORM_BODY_PATTERN = re.compile(r'[^=&\s]+=[^&\s]*(?:&[^=&\s]+=[^&\s]*)*')
+
+def mark_placeholders(data, slots, escape, columns=()):
+    """ Same substitution as replace_placeholders, but dynamic placeholders and feeder columns become slots """
+    if isinstance(data, dict):
+        return {key: mark_placeholders(value, slots, escape, columns) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [mark_placeholders(item, slots, escape, columns) for item in data]
+    elif isinstance(data, str):
+        raw = RAW_SLOT_PATTERN.fullmatch(data)
+        if raw:
+            slots.append((raw.group(1), 'raw'))
+            return f"{RAW_OPEN}{len(slots) - 1}{RAW_CLOSE}"
+        for column in columns:
+            placeholder = f"{{{{{column}}}}}"
+            if placeholder in data:
+                slots.append((placeholder, escape))
+                data = data.replace(placeholder, f"{SLOT_OPEN}{len(slots) - 1}{SLOT_CLOSE}")
+        for placeholder, value in STATIC_PLACEHOLDERS.items():
+            data = data.replace(placeholder, value)
+        for placeholder in DYNAMIC_PLACEHOLDERS:
+            if placeholder in data:
+                slots.append((placeholder, escape))
+                data = data.replace(placeholder, f"{SLOT_OPEN}{len(slots) - 1}{SLOT_CLOSE}")
+        return UNKNOWN_PLACEHOLDER_PATTERN.sub('333', data)
+    return data
+
+def slot_text(value):
+    """ Text of a send-time value the way Postman stringifies it: true, null and JSON objects, not Python reprs """
+    return value if isinstance(value, str) else json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+# How a send-time value is escaped for the text it is spliced into
+SLOT_ESCAPES = {
+    'json': lambda value: json.dumps(slot_text(value))[1:-1],
+    'raw': slot_text,
+    'form': lambda value: quote_plus(slot_text(value)),
+    'url': lambda value: quote(slot_text(value), safe=''),
+    'text': slot_text,
+}
+
+def make_slot(placeholder, escape):
+    """ Returns a callable producing the escaped value of a slot, feeder columns are read from the row """
+    escape_value = SLOT_ESCAPES[escape]
+    factory = DYNAMIC_PLACEHOLDERS.get(placeholder)
+    if factory:
+        return lambda row: escape_value(factory())
+    column = placeholder[2:-2]
+    return lambda row: escape_value(row[column])
+
+def split_slots(text, slots, slot_pattern=TEXT_SLOT_PATTERN):
+    """ Splits marked text into its literal parts and the (placeholder, escape) of each slot """
+    pieces = slot_pattern.split(text)
+    step = slot_pattern.groups + 1
+    parts = tuple(pieces[0::step])
+    indexes = [next(index for index in pieces[start:start + step - 1] if index is not None)
+               for start in range(1, len(pieces), step)]
+    return parts, tuple(slots[int(index)] for index in indexes)
+
+class TextTemplate:
+    """ String with send-time slots for dynamic placeholders and feeder columns """
+    __slots__ = ('parts', 'placeholders', 'slots', 'static')
+
+    def __init__(self, parts, placeholders):
+        self.parts = parts
+        self.placeholders = placeholders
+        self.slots = tuple(make_slot(placeholder, escape) for placeholder, escape in placeholders)
+        self.static = parts[0] if not placeholders else None
+
+    def __repr__(self):
+        # Generated modules embed templates through repr
+        return f"{type(self).__name__}({self.parts!r}, {self.placeholders!r})"
+
+    def render(self, row=None):
+        """ Returns the text to send, filling slots if there are any """
+        if self.static is not None:
+            return self.static
+        parts = self.parts
+        rendered = [parts[0]]
+        for index, slot in enumerate(self.slots, 1):
+            rendered.append(slot(row))
+            rendered.append(parts[index])
+        return ''.join(rendered)
+
+class BodyTemplate(TextTemplate):
+    """ Request body pre-rendered to bytes, with send-time slots for dynamic placeholders and feeder columns """
+    __slots__ = ('content_type',)
+
+    def __init__(self, parts, placeholders, content_type):
+        super().__init__(parts, placeholders)
+        self.content_type = content_type
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.parts!r}, {self.placeholders!r}, {self.content_type!r})"
+
+    def render(self, row=None):
+        """ Returns the bytes to send, filling slots if the body has any """
+        if self.static is not None:
+            return self.static
+        parts = self.parts
+        rendered = [parts[0]]
+        for index, slot in enumerate(self.slots, 1):
+            rendered.append(slot(row).encode('utf-8'))
+            rendered.append(parts[index])
+        return b''.join(rendered)
+
+def compile_body(raw_body, columns=()):
+    """ Templates a raw Postman body once and returns a BodyTemplate """
+    slots = []
+    quoted_body = BARE_COLUMN_PATTERN.sub(
+        lambda match: f'{match.group(1)}"{RAW_OPEN}{{{{{match.group(2)}}}}}{RAW_CLOSE}"'
+        if match.group(2) in columns else match.group(0),
+        raw_body)
     try:
-        data = json.loads(raw_body)
-        return replace_placeholders(data)
+        data = json.loads(quoted_body)
     except json.JSONDecodeError:
+        if FORM_BODY_PATTERN.fullmatch(raw_body):
+            content_type = 'application/x-www-form-urlencoded'
+            escape = 'form'
+        else:
+            content_type = 'text/plain; charset=utf-8'
+            escape = 'text'
+        text = mark_placeholders(raw_body, slots, escape, columns)
+        slot_pattern = TEXT_SLOT_PATTERN
+    else:
+        # Same serialization requests uses for json=, so the bytes on the wire do not change
+        text = json.dumps(mark_placeholders(data, slots, 'json', columns), allow_nan=False)
+        slot_pattern = JSON_SLOT_PATTERN
+        content_type = 'application/json'
+
+    parts, placeholders = split_slots(text, slots, slot_pattern)
+    return BodyTemplate(tuple(part.encode('utf-8') for part in parts), placeholders, content_type)
+
+def mark_columns(text, columns, escape='text'):
+    """ Replaces feeder columns in text with slot markers, returns the marked text and its slots """
+    slots = []
+    for column in columns:
+        placeholder = f"{{{{{column}}}}}"
+        if placeholder in text:
+            slots.append((placeholder, escape))
+            text = text.replace(placeholder, f"{SLOT_OPEN}{len(slots) - 1}{SLOT_CLOSE}")
+    return text, slots
+
+def column_template(text, columns):
+    """ Returns text as a TextTemplate if it uses feeder columns, unchanged otherwise """
+    marked, slots = mark_columns(text, columns)
+    return TextTemplate(*split_slots(marked, slots)) if slots else text
+
+def fill_row(value, row):
+    """ Renders a feeder template with one row, plain strings pass through """
+    return value.render(row) if isinstance(value, TextTemplate) else value
+
+def fill_headers(headers, row):
+    """ Renders the feeder templates among header values with one row """
+    return {key: fill_row(value, row) for key, value in headers.items()}
+
+CompiledRequest = namedtuple('CompiledRequest',
+                             ['key', 'folder', 'method', 'url', 'name', 'headers', 'body', 'fed', 'checks', 'chained'],
+                             defaults=(False, None, False))
+CompiledRequest.__doc__ = """ Pre-resolved request shared read-only by every user in the process """
+
+# Postman test scripts: the common pm.test/pm.expect assertions are translated to precompiled checks
+JS_STRING = r'''"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*\''''
+JS_NUMBER = r'-?\d+(?:\.\d+)?'
+JS_LITERAL = f'(?:{JS_STRING}|{JS_NUMBER}|true|false|null)'
+TEST_BLOCK_PATTERN = re.compile(
+    f'pm\\.test\\(\\s*({JS_STRING})\\s*,\\s*(?:function\\s*\\(\\s*\\)|\\(\\s*\\)\\s*=>)\\s*{{')
+JSON_ALIAS_PATTERN = re.compile(r'(?:var|let|const) ([A-Za-z_$][\w$]*)=pm\.response\.json\(\)')
+# Every Postman variable scope is one per-user scope here
+VARIABLE_SET_PATTERN = re.compile(
+    f'pm\\.(?:environment|collectionVariables|globals|variables)\\.set\\(({JS_STRING}),(.+)\\)')
+JSON_PATH_PATTERN = re.compile(f'\\.([A-Za-z_$][\\w$]*)|\\[(\\d+)\\]|\\[({JS_STRING})\\]')
+
+# (pattern of a whole statement, subject, op, expected)
+RESPONSE_ASSERTIONS = [
+    (re.compile(r'pm\.response\.to\.have\.status\((\d+)\)'), 'status', 'eq', int),
+    (re.compile(r'pm\.response\.to\.be\.ok'), 'status', 'eq', 200),
+    (re.compile(r'pm\.response\.to\.be\.success'), 'status', 'range', (200, 299)),
+    (re.compile(r'pm\.response\.to\.not\.be\.error'), 'status', 'lt', 400),
+    (re.compile(r'pm\.expect\(function\(\)\{pm\.response\.json\(\);?\}\)\.(?:not\.to|to\.not)\.throw\(\)'),
+     'json', 'valid', None),
+    (re.compile(r'pm\.response\.to\.(?:be\.json|have\.jsonBody\(\))'), 'json', 'valid', None),
+    (re.compile(f'pm\\.response\\.to\\.have\\.body\\(({JS_STRING})\\)'), 'text', 'eq', 'literal'),
+]
+HEADER_ASSERTION_PATTERN = re.compile(f'pm\\.response\\.to\\.have\\.header\\(({JS_STRING})(?:,({JS_LITERAL}))?\\)')
+
+# (pattern of the chain after pm.expect(...), op); the single group is the expected literal
+EXPECT_CHAINS = [
+    (re.compile(f'\\.to(?:\\.deep)?(?:\\.be)?\\.(?:eql|equal|eq|equals)\\(({JS_LITERAL})\\)'), 'eq'),
+    (re.compile(f'\\.(?:to\\.not|not\\.to)(?:\\.be)?\\.(?:eql|equal|eq|equals)\\(({JS_LITERAL})\\)'), 'ne'),
+    (re.compile(f'\\.to\\.be\\.oneOf\\((\\[{JS_LITERAL}(?:,{JS_LITERAL})*\\])\\)'), 'in'),
+    (re.compile(f'\\.to\\.(?:be\\.)?(?:below|lessThan|lt)\\(({JS_NUMBER})\\)'), 'lt'),
+    (re.compile(f'\\.to\\.(?:be\\.)?(?:above|greaterThan|gt)\\(({JS_NUMBER})\\)'), 'gt'),
+    (re.compile(f'\\.to\\.be\\.(?:at\\.most|lte)\\(({JS_NUMBER})\\)'), 'le'),
+    (re.compile(f'\\.to\\.be\\.(?:at\\.least|gte)\\(({JS_NUMBER})\\)'), 'ge'),
+    (re.compile(f'\\.to\\.(?:include|contain|have\\.string)\\(({JS_LITERAL})\\)'), 'include'),
+    (re.compile(r'\.to\.(?:exist|not\.be\.undefined)()'), 'exists'),
+    (re.compile(r'\.to\.be\.(true|false|null)'), 'eq'),
+    (re.compile(f'\\.to\\.have\\.property\\(({JS_STRING})\\)'), 'property'),
+    (re.compile(f'\\.to\\.be\\.an?\\(({JS_STRING})\\)'), 'type'),
+]
+
+ResponseCheck = namedtuple('ResponseCheck', ['test', 'subject', 'path', 'op', 'expected'])
+ResponseCheck.__doc__ = """ One translated assertion; path is a header name or a tuple of JSON keys """
+
+Extraction = namedtuple('Extraction', ['variable', 'subject', 'path'])
+Extraction.__doc__ = """ pm.environment.set of a response value into the user's variables, read by later slots """
+
+MISSING = object()
+JSON_DECODER = json.JSONDecoder()
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def json_type(value):
+    """ Returns the chai type name of a parsed JSON value """
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    return {str: 'string', list: 'array', dict: 'object'}.get(type(value), 'undefined')
+
+def same_value(actual, expected):
+    """ JSON equality that, unlike Python, does not treat true as 1 """
+    return isinstance(actual, bool) == isinstance(expected, bool) and actual == expected
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+CHECK_OPS = {
+    'eq': same_value,
+    'ne': lambda actual, expected: actual is not MISSING and not same_value(actual, expected),
+    'in': lambda actual, expected: any(same_value(actual, value) for value in expected),
+    'lt': lambda actual, expected: is_number(actual) and actual < expected,
+    'le': lambda actual, expected: is_number(actual) and actual <= expected,
+    'gt': lambda actual, expected: is_number(actual) and actual > expected,
+    'ge': lambda actual, expected: is_number(actual) and actual >= expected,
+    'range': lambda actual, expected: is_number(actual) and expected[0] <= actual <= expected[1],
+    'include': lambda actual, expected: isinstance(actual, (str, list)) and expected in actual,
+    'exists': lambda actual, expected: actual is not MISSING and actual is not None,
+    'type': lambda actual, expected: json_type(actual) == expected,
+}
+
+def json_lookup(data, path):
+    """ Follows a tuple of keys and indexes into parsed JSON, MISSING when any step is absent """
+    for key in path:
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return MISSING
+    return data
+
+def skip_json_whitespace(text, index):
+    return JSON_WHITESPACE.match(text, index).end()
+
+def json_member_index(text, index, key):
+    """ Returns where the value of `key` starts in the object at index, -1 if the object has no such member """
+    index = skip_json_whitespace(text, index + 1)
+    if text.startswith('}', index):
+        return -1
+    while True:
+        if not text.startswith('"', index):
+            raise ValueError(f"Expecting property name at {index}")
+        name, index = json.decoder.scanstring(text, index + 1)
+        index = skip_json_whitespace(text, index)
+        if not text.startswith(':', index):
+            raise ValueError(f"Expecting ':' at {index}")
+        index = skip_json_whitespace(text, index + 1)
+        if name == key:
+            return index
+        index = skip_json_whitespace(text, JSON_DECODER.raw_decode(text, index)[1])
+        if not text.startswith(',', index):
+            return -1
+        index = skip_json_whitespace(text, index + 1)
+
+def json_item_index(text, index, position):
+    """ Returns where item `position` starts in the array at index, -1 if the array is shorter """
+    index = skip_json_whitespace(text, index + 1)
+    if text.startswith(']', index):
+        return -1
+    for _ in range(position):
+        index = skip_json_whitespace(text, JSON_DECODER.raw_decode(text, index)[1])
+        if not text.startswith(',', index):
+            return -1
+        index = skip_json_whitespace(text, index + 1)
+    return index
+
+def json_extract(text, path):
+    """ Decodes only the value at path: siblings before it are skipped, the rest of the document is never read """
+    index = skip_json_whitespace(text, 0)
+    for key in path:
+        if isinstance(key, str) and text.startswith('{', index):
+            index = json_member_index(text, index, key)
+        elif isinstance(key, int) and text.startswith('[', index):
+            index = json_item_index(text, index, key)
+        else:
+            return MISSING
+        if index < 0:
+            return MISSING
+    return JSON_DECODER.raw_decode(text, index)[0]
+
+class ResponseChecks:
+    """ Translated pm.test assertions and variable extractions of one request, run inside catch_response """
+    __slots__ = ('checks', 'extractions', 'needs_body')
+
+    def __init__(self, checks, extractions=()):
+        self.checks = tuple(checks)
+        self.extractions = tuple(extractions)
+        # Only JSON and text subjects read the body, the others keep streamed responses streamed
+        self.needs_body = (any(check.subject in ('json', 'text') for check in self.checks)
+                           or any(extraction.subject == 'json' for extraction in self.extractions))
+
+    def __repr__(self):
+        if self.extractions:
+            return f"ResponseChecks({self.checks!r}, {self.extractions!r})"
+        return f"ResponseChecks({self.checks!r})"
+
+    def run(self, response, variables):
+        """ Stores extracted values in variables, returns the message of the first failing assertion or None """
+        message, data = self.evaluate(response)
+        text = None
+        for extraction in self.extractions:
+            if extraction.subject == 'header':
+                value = (response.headers or {}).get(extraction.path, MISSING)
+            elif data is not MISSING:
+                value = json_lookup(data, extraction.path)
+            else:
+                # No assertion parsed the body, so only the path to each extracted value is decoded
+                try:
+                    text = text if text is not None else response.content.decode('utf-8')
+                    value = json_extract(text, extraction.path)
+                except ValueError:
+                    value = MISSING
+            if value is not MISSING:
+                variables[extraction.variable] = value
+        return message
+
+    def evaluate(self, response):
+        """ Returns (message of the first failing assertion or None, the parsed JSON body if it was needed) """
+        data = MISSING
+        for check in self.checks:
+            subject = check.subject
+            if subject == 'status':
+                actual = response.status_code
+            elif subject == 'response_time':
+                actual = response.request_meta["response_time"]
+            elif subject == 'header':
+                actual = (response.headers or {}).get(check.path, MISSING)
+            elif subject == 'text':
+                actual = response.text
+            else:
+                if data is MISSING:
+                    # Parsed at most once per response, and only when a JSON assertion asks for it
+                    try:
+                        data = json.loads(response.content)
+                    except (ValueError, TypeError):
+                        return f"{check.test}: response is not valid JSON", MISSING
+                if check.op == 'valid':
+                    continue
+                actual = json_lookup(data, check.path)
+            if not CHECK_OPS[check.op](actual, check.expected):
+                actual = 'missing' if actual is MISSING else repr(actual)[:100]
+                return f"{check.test}: expected {subject} {check.op} {check.expected!r}, got {actual}", data
+        return None, data
+
+def parse_js_literal(literal):
+    """ Parses a JavaScript literal (numbers, strings in either quote, booleans, null, arrays of those) """
+    if literal[:1] == "'":
+        literal = json.dumps(re.sub(r"\\(.)", r"\1", literal[1:-1]))
+    elif literal[:1] == '[':
+        return [parse_js_literal(match.group(0)) for match in re.finditer(JS_LITERAL, literal)]
+    return json.loads(literal)
+
+def scan_js(source):
+    """ Yields (index, char, depth) of the code outside string literals and comments """
+    depth = 0
+    index = 0
+    while index < len(source):
+        char = source[index]
+        if char in '"\'`':
+            end = index + 1
+            while end < len(source) and source[end] != char:
+                end += 2 if source[end] == '\\' else 1
+            index = end + 1
+            continue
+        if source.startswith('//', index):
+            index = source.find('\n', index)
+            if index < 0:
+                return
+            continue
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        yield index, char, depth
+        index += 1
+
+def compact_js(statement):
+    """ Drops comments and the whitespace that does not separate two words, string literals stay as they are """
+    keep_strings = lambda match: match.group(1) or ''
+    statement = re.sub(f'({JS_STRING})|//[^\\n]*', keep_strings, statement)
+    statement = re.sub(f'({JS_STRING})|\\s+', lambda match: match.group(1) or ' ', statement)
+    return re.sub(f'({JS_STRING})| (?![\\w$])|(?<![\\w$]) ', keep_strings, statement).strip()
+
+def split_js_statements(body):
+    """ Splits a function body at top level semicolons and line breaks, keeping chained calls together """
+    statements = []
+    start = 0
+    for index, char, depth in scan_js(body):
+        if depth == 0 and char in ';\n':
+            statements.append(body[start:index])
+            start = index + 1
+    statements.append(body[start:])
+    merged = []
+    for statement in statements:
+        statement = compact_js(statement)
+        if statement.startswith('.') and merged:
+            merged[-1] += statement
+        elif statement:
+            merged.append(statement)
+    return merged
+
+def closing_index(source, open_index):
+    """ Returns the index of the bracket closing the one at open_index, -1 if it is never closed """
+    for index, char, depth in scan_js(source[open_index:]):
+        if depth == 0:
+            return open_index + index
+    return -1
+
+def parse_subject(target, aliases):
+    """ Parses what a script reads from the response into (subject, path), None if it is not supported """
+    if target == 'pm.response.code':
+        return 'status', ()
+    if target == 'pm.response.responseTime':
+        return 'response_time', ()
+    if target == 'pm.response.text()':
+        return 'text', ()
+    match = re.fullmatch(f'pm\\.response\\.headers\\.get\\(({JS_STRING})\\)', target)
+    if match:
+        return 'header', parse_js_literal(match.group(1))
+    for root in ('pm.response.json()', *aliases):
+        keys = target[len(root):]
+        if not target.startswith(root) or keys[:1] not in ('', '.', '['):
+            continue
+        matches = list(JSON_PATH_PATTERN.finditer(keys))
+        if ''.join(match.group(0) for match in matches) != keys:
+            return None
+        return 'json', tuple(int(index) if index else parse_js_literal(quoted) if quoted else name
+                             for name, index, quoted in (match.groups() for match in matches))
+    return None
+
+def translate_extraction(statement, aliases):
+    """ Translates pm.<scope>.set("name", <response value>) into an Extraction, None if it is not supported """
+    match = VARIABLE_SET_PATTERN.fullmatch(statement)
+    if not match:
         return None
+    variable = parse_js_literal(match.group(1))
+    parsed = parse_subject(match.group(2), aliases)
+    if not re.fullmatch(r'\w+', variable) or parsed is None or parsed[0] not in ('json', 'header'):
+        return None
+    return Extraction(variable, *parsed)
+
+def translate_expect(test, statement, aliases):
+    """ Translates pm.expect(<subject>)<chain>, returns None for unknown subjects or chains """
+    if not statement.startswith('pm.expect('):
+        return None
+    end = closing_index(statement, len('pm.expect'))
+    if end < 0:
+        return None
+    target, chain = statement[len('pm.expect('):end], statement[end + 1:]
+    match = re.fullmatch(f'pm\\.response\\.headers\\.has\\(({JS_STRING})\\)', target)
+    if match:
+        if chain != '.to.be.true':
+            return None
+        return ResponseCheck(test, 'header', parse_js_literal(match.group(1)), 'exists', None)
+    parsed = parse_subject(target, aliases)
+    if parsed is None:
+        return None
+    subject, path = parsed
+
+    for pattern, op in EXPECT_CHAINS:
+        match = pattern.fullmatch(chain)
+        if not match:
+            continue
+        expected = parse_js_literal(match.group(1)) if match.group(1) else None
+        if op == 'property':
+            if subject != 'json':
+                return None
+            path, op, expected = path + (expected,), 'exists', None
+        elif subject == 'header' and op in ('lt', 'le', 'gt', 'ge', 'type'):
+            return None
+        return ResponseCheck(test, subject, path, op, expected)
+    return None
+
+def translate_statement(test, statement, aliases):
+    """ Translates one assertion statement into a ResponseCheck, None if it is not understood """
+    for pattern, subject, op, expected in RESPONSE_ASSERTIONS:
+        match = pattern.fullmatch(statement)
+        if match:
+            if expected is int:
+                expected = int(match.group(1))
+            elif expected == 'literal':
+                expected = parse_js_literal(match.group(1))
+            return ResponseCheck(test, subject, (), op, expected)
+    match = HEADER_ASSERTION_PATTERN.fullmatch(statement)
+    if match:
+        name = parse_js_literal(match.group(1))
+        if match.group(2) is None:
+            return ResponseCheck(test, 'header', name, 'exists', None)
+        return ResponseCheck(test, 'header', name, 'eq', str(parse_js_literal(match.group(2))))
+    return translate_expect(test, statement, aliases)
+
+def test_scripts(item):
+    """ Yields the source of each test script attached to a collection item """
+    for event in item.get('event', []):
+        if event.get('listen') == 'test':
+            source = event.get('script', {}).get('exec', [])
+            yield '\n'.join(source) if isinstance(source, list) else source
+
+def compile_test_script(source):
+    """ Translates a Postman test script, returns (checks, extractions, untranslated statements) """
+    blocks = []
+    outside = []
+    position = 0
+    while match := TEST_BLOCK_PATTERN.search(source, position):
+        end = closing_index(source, match.end() - 1)
+        if end < 0:
+            break
+        outside.append(source[position:match.start()])
+        blocks.append((parse_js_literal(match.group(1)), source[match.end():end]))
+        position = end + 1
+        position += re.match(r'\s*\)?\s*;?', source[position:]).end()
+    outside.append(source[position:])
+
+    # Code between the blocks may only hold aliases such as `var jsonData = pm.response.json();` and extractions
+    aliases = []
+    extractions = []
+    untranslated = []
+    for statement in split_js_statements('\n'.join(outside)):
+        if alias := JSON_ALIAS_PATTERN.fullmatch(statement):
+            aliases.append(alias.group(1))
+        elif extraction := translate_extraction(statement, aliases):
+            extractions.append(extraction)
+        else:
+            untranslated.append(statement)
+
+    checks = []
+    for test, body in blocks:
+        for statement in split_js_statements(body):
+            if alias := JSON_ALIAS_PATTERN.fullmatch(statement):
+                aliases.append(alias.group(1))
+            elif extraction := translate_extraction(statement, aliases):
+                extractions.append(extraction)
+            elif check := translate_statement(test, statement, aliases):
+                checks.append(check)
+            else:
+                untranslated.append(f"{test}: {statement}")
+    return checks, extractions, untranslated
 
-class DynamicTaskSet:
-    def __init__(self, parent):
-        self.parent = parent
+
+def template_path(url):
+    """ Turns a raw Postman URL into a path template such as /json/get-location/{id} """
+    path = TEMPLATE_HOST_PATTERN.sub('', url).split('?', 1)[0].split('#', 1)[0]
+    segments = []
+    for segment in path.split('/'):
+        if segment.startswith(':'):
+            segment = f"{{{segment[1:]}}}"
+        elif segment.startswith('{{') and segment.endswith('}}'):
+            segment = f"{{{segment[2:-2]}}}"
+        elif TEMPLATE_ID_PATTERN.search(segment) and not TEMPLATE_VERSION_PATTERN.fullmatch(segment):
+            segment = '{id}'
+        segments.append(segment)
+    return '/'.join(segments) or '/'
+
+class RequestNamer:
+    """ Picks the stats name of each request and caps how many distinct names a run can produce """
+    OTHER = 'other'
+
+    def __init__(self, mode='path', max_names=MAX_REQUEST_NAMES):
+        self.mode = mode
+        self.max_names = max_names
+        self.names = set()
+
+    def name(self, path, raw_url, item_key):
+        """ Returns the name for a request, or 'other' once the cap is reached """
+        if self.mode == 'item':
+            name = item_key
+        elif self.mode == 'template':
+            name = template_path(raw_url)
+        else:
+            name = path
+        if name not in self.names:
+            if len(self.names) >= self.max_names:
+                return self.OTHER
+            self.names.add(name)
+        return name
+
+class RequestPlan:
+    """ Compiles a Postman collection once into a compact, read-only list of requests """
+
+    def __init__(self, collection_file, namer=None, columns=()):
+        self.collection_file = collection_file
+        self.namer = namer or RequestNamer()
+        self.feeder_columns = tuple(columns)
+        self.columns = self.feeder_columns  # Feeder columns and extracted variables, bound at send time
+        self.variables = {}  # Variables set by test scripts, with their collection value as the default
         self.url_variables = {}
-        self.tasks = []
-        self.error_summary = defaultdict(list)
-        self.seen_errors = set()
+        self.base_url = None
+        self.requests = []
+        self.load_errors = set()
 
-        with open(COLLECTION_FILE_NAME) as f:
-            self.collection = json.load(f)
+        # The raw collection (including the large cURL/cookie descriptions) is only
+        # kept alive while compiling, the plan itself holds just what a task sends.
+        with open(collection_file) as f:
+            collection = json.load(f)
 
-        self.extract_variables()
-        self.create_tasks(self.collection['item'])
+        self.extract_variables(collection)
+        for name in self.collect_extracted_variables(collection['item']):
+            if name not in self.feeder_columns:
+                self.variables.setdefault(name, str(self.url_variables.get(name, '')))
+        self.columns = self.feeder_columns + tuple(self.variables)
+        self.create_tasks(collection['item'])
+        self.requests = tuple(self.requests)
+        self.tasks = [make_task(compiled) for compiled in self.requests]
+        self.scenarios = make_scenarios(self.requests, self.tasks)
 
-    def extract_variables(self):
+    def extract_variables(self, collection):
         """ Extracts URL variables """
         # Extract variables from collection if they exist
-        collection_variables = {var['key']: var['value'] for var in self.collection.get('variable', [])}
-        
+        collection_variables = {var['key']: var['value'] for var in collection.get('variable', [])}
+
         # Set default baseUrl if not found in collection
         self.url_variables = collection_variables.copy()
         if 'baseUrl' not in self.url_variables:
             self.url_variables['baseUrl'] = 'https://www.obilet.com'
-        
-        # Extract base URL for HttpUser host
-        base_url = self.url_variables.get('baseUrl', 'https://www.obilet.com')
+
         # Remove trailing slash if present
-        base_url = base_url.rstrip('/')
-        self.base_url = base_url
-        
-        # Set host in parent user's environment
-        if hasattr(self.parent, 'environment') and self.parent.environment:
-            self.parent.environment.host = base_url
+        self.base_url = self.url_variables['baseUrl'].rstrip('/')
+
+    def collect_extracted_variables(self, items):
+        """ Yields the variable names test scripts anywhere in the collection set from responses """
+        for item in items:
+            if 'item' in item:
+                yield from self.collect_extracted_variables(item['item'])
+            for source in test_scripts(item):
+                for extraction in compile_test_script(source)[1]:
+                    yield extraction.variable
 
     def create_tasks(self, items, parent_key=None):
-        """ Dynamically creates tasks """
+        """ Walks collection folders and compiles every request """
         for item in items:
             if 'item' in item:
                 self.create_tasks(item['item'], parent_key=item.get('name', 'Unknown'))
@@ -139,7 +913,7 @@ class DynamicTaskSet:
                 self.add_task(item, parent_key)
 
     def add_task(self, request_item, parent_key):
-        """ Adds a task for each request """
+        """ Resolves URL, name, headers and body of a single request """
         try:
             method = request_item['request']['method'].lower()
 
@@ -163,22 +937,19 @@ class DynamicTaskSet:
             if not url:
                 raise ValueError("URL could not be extracted from request")
 
-            headers = {header['key']: replace_placeholders(header['value'])
+            headers = {header['key']: column_template(replace_placeholders(header['value']), self.columns)
                        for header in request_item['request'].get('header', [])}
 
+            raw_url = url
+            # Feeder columns stay slot markers while the collection variables are resolved
+            url, url_slots = mark_columns(url, self.columns, 'url')
             url = replace_path_variables(url, headers, self.url_variables)
-            
-            # Convert full URL to relative path if it starts with baseUrl
-            from urllib.parse import urlparse
-            base_url = self.base_url if hasattr(self, 'base_url') else self.url_variables.get('baseUrl', 'https://www.obilet.com')
-            base_url = base_url.rstrip('/')
-            
+
             # Initialize url_name
             url_name = url
-            
+
             # If URL is a full URL and starts with baseUrl, convert to relative path
-            if url.startswith(base_url):
-                # Extract path from full URL
+            if url.startswith(self.base_url):
                 parsed = urlparse(url)
                 url_path = parsed.path
                 if parsed.query:
@@ -186,131 +957,932 @@ class DynamicTaskSet:
                 url = url_path
                 url_name = url_path
             elif url.startswith('http://') or url.startswith('https://'):
-                # Full URL but different base - extract path for name, but we'll need to handle this differently
+                # Full URL but different base - keep the full URL, use the path as name
                 parsed = urlparse(url)
                 url_path = parsed.path
                 if parsed.query:
                     url_path += f"?{parsed.query}"
                 url_name = url_path
-                # For now, keep the full URL - we'll handle it in the task function
-                # But this shouldn't happen if baseUrl is set correctly
-                print(f"Warning: URL {url} doesn't match baseUrl {base_url}")
-            else:
-                # Relative URL - use as is
-                url_name = url
-
-            @task
-            def task_func(user):
-                request_method = getattr(user.client, method)
-                body = None
-
-                if 'body' in request_item['request'] and 'raw' in request_item['request']['body']:
-                    raw_body = request_item['request']['body']['raw'].strip()
-                    if raw_body:
-                        # Replace {{baseUrl}} and other variables in body if it's a string
-                        if isinstance(raw_body, str):
-                            # Replace Postman variables in body
-                            body_vars = re.findall(r'\{\{(\w+)\}\}', raw_body)
-                            for var_name in body_vars:
-                                if var_name in self.url_variables:
-                                    raw_body = raw_body.replace(f'{{{{{var_name}}}}}', str(self.url_variables[var_name]))
-                                elif var_name in headers:
-                                    raw_body = raw_body.replace(f'{{{{{var_name}}}}}', str(headers[var_name]))
-                        body = parse_json(raw_body)
-
-                # Use the processed URL (now relative path)
-                with request_method(url, headers=headers, json=body, name=url_name, catch_response=False) as response:
-                    error_message = f"{method.upper()} request to {url}. Response: {response.text}"
-                    if response.status_code >= 400:
-                        if error_message not in self.seen_errors:
-                            self.seen_errors.add(error_message)
-                            self.error_summary[response.status_code].append(error_message)
-                            response.failure(f"Error: {response.status_code} - {response.text}")
-                    else:
-                        self.check_response_time(response)
-
-            self.tasks.append((f"{parent_key} - {request_item['name']}", task_func))
+                print(f"Warning: URL {url} doesn't match baseUrl {self.base_url}")
+
+            body = None
+            if 'body' in request_item['request'] and 'raw' in request_item['request']['body']:
+                raw_body = request_item['request']['body']['raw'].strip()
+                if raw_body:
+                    # Replace Postman variables in body
+                    body_vars = re.findall(r'\{\{(\w+)\}\}', raw_body)
+                    for var_name in body_vars:
+                        if var_name in self.columns:
+                            continue
+                        if var_name in self.url_variables:
+                            raw_body = raw_body.replace(f'{{{{{var_name}}}}}', str(self.url_variables[var_name]))
+                        elif var_name in headers:
+                            raw_body = raw_body.replace(f'{{{{{var_name}}}}}', str(headers[var_name]))
+                    body = compile_body(raw_body, self.columns)
+                    if not any(key.lower() == 'content-type' for key in headers):
+                        headers['Content-Type'] = body.content_type
+
+            placeholders = [*url_slots, *(placeholder for value in headers.values()
+                                           if isinstance(value, TextTemplate) for placeholder in value.placeholders)]
+            if body:
+                placeholders += body.placeholders
+            slot_names = {placeholder[2:-2] for placeholder, escape in placeholders if placeholder.startswith('{{')}
+            if url_slots:
+                url_name = TEXT_SLOT_PATTERN.sub(lambda match: f"{{{url_slots[int(match.group(1))][0][2:-2]}}}", url_name)
+                url = TextTemplate(*split_slots(url, url_slots))
+
+            key = f"{parent_key} - {request_item['name']}"
+            checks = self.compile_checks(request_item, key)
+            self.requests.append(CompiledRequest(
+                key=key,
+                folder=parent_key,
+                method=method,
+                url=url,
+                name=self.namer.name(url_name, raw_url, key),
+                headers=headers,
+                body=body,
+                fed=any(name in slot_names for name in self.feeder_columns),
+                checks=checks,
+                chained=any(name in slot_names for name in self.variables),
+            ))
 
         except KeyError as e:
-            error_message = f"KeyError: '{e.args[0]}' not found in the request item or URL."
-            if error_message not in self.seen_errors:
-                self.seen_errors.add(error_message)
-                print(error_message)
+            self.report_load_error(f"KeyError: '{e.args[0]}' not found in the request item or URL.")
         except Exception as e:
-            error_message = f"Error processing request: {str(e)}"
-            if error_message not in self.seen_errors:
-                self.seen_errors.add(error_message)
-                print(error_message)
+            self.report_load_error(f"Error processing request: {str(e)}")
+
+    def compile_checks(self, request_item, key):
+        """ Translates the request's Postman test scripts, reporting statements that have no translation """
+        checks = []
+        extractions = []
+        for source in test_scripts(request_item):
+            translated, extracted, untranslated = compile_test_script(source)
+            checks += translated
+            extractions += extracted
+            for statement in untranslated:
+                self.report_load_error(f"Untranslated test script in '{key}': {statement}")
+        return ResponseChecks(checks, extractions) if checks or extractions else None
+
+    def report_load_error(self, error_message):
+        """ Prints each distinct compile error once """
+        if error_message not in self.load_errors:
+            self.load_errors.add(error_message)
+            print(error_message)
+
+
+def make_task(compiled, profiler=None):
+    """ Creates the locust task for a compiled request, timing its phases when a profiler is given """
+    method = compiled.method
+    # Assertions on the body need it buffered even when --response-mode streams
+    stream = not (compiled.checks and compiled.checks.needs_body)
+
+    @task
+    def task_func(user):
+        clock = profiler.clock(compiled.name) if profiler else None
+        request_method = getattr(user.client, method)
+        if compiled.fed or compiled.chained:
+            row = request_row(user, compiled.fed, compiled.chained)
+            url = fill_row(compiled.url, row)
+            headers = fill_headers(compiled.headers, row)
+            body = compiled.body.render(row) if compiled.body else None
+        else:
+            url, headers = compiled.url, compiled.headers
+            body = compiled.body.render() if compiled.body else None
+        if clock:
+            clock.lap('template')
+        lag = schedule_lag(user)
+        context = request_method(url, headers=headers, data=body, name=compiled.name,
+                                 stream=stream and user.stream_responses, catch_response=True)
+        if clock:
+            clock.lap('request')
+        with context as response:
+            handle_response(user, response, method.upper(), compiled.name, lag, compiled.checks, clock)
+        if clock:
+            clock.finish()
+
+    return task_func
+
+def make_scenarios(requests, tasks):
+    """ One FolderScenario per collection folder, running its requests in collection order """
+    folders = {}
+    for compiled, request_task in zip(requests, tasks):
+        folders.setdefault(compiled.folder or 'Unknown', []).append(request_task)
+    return [type('FolderScenario', (FolderScenario,), {'folder': folder, 'tasks': folder_tasks})
+            for folder, folder_tasks in folders.items()]
+
+def request_row(user, fed, chained):
+    """ Values for the send-time slots of a request: a feeder row, the user's variables, or both """
+    if not fed:
+        return user.variables
+    row = user.feeder.next_row()
+    return {**user.variables, **row} if chained else row
+
+
+def schedule_lag(user):
+    """ Open model: how late a request starts compared to its arrival schedule slot, None otherwise """
+    return time.perf_counter() - user.intended_start if user.intended_start is not None else None
+
+def handle_response(user, response, method, name, lag=None, checks=None, clock=None):
+    """ Marks a collection response as failed or successful, shared by runtime and generated tasks """
+    if lag is not None:
+        measure_from_intended_start(response, lag)
+    stream = user.stream_responses and not (checks and checks.needs_body)
+    if response.status_code >= 400:
+        response_text = read_failure_body(response, user.failure_body_limit, stream)
+        if clock:
+            clock.lap('error_body')
+        user.error_aggregator.record(method, name, response.status_code, response_text)
+        if clock:
+            clock.lap('error_bookkeeping')
+        response.failure(f"Error: {response.status_code} - {response_text}")
+    elif response.status_code:
+        if stream:
+            finish_streamed_body(response)
+            if clock:
+                clock.lap('body')
+        message = checks.run(response, user.variables) if checks else None
+        if clock and checks:
+            clock.lap('checks')
+        if message:
+            response.failure(f"Test failed: {message}")
+        else:
+            check_response_time(response)
+    # status 0 is a connection error, locust already reports its exception
+
+def measure_from_intended_start(response, schedule_lag):
+    """ Reports a request as started at its scheduled slot, so queueing in the generator counts as latency """
+    request_meta = response.request_meta
+    request_meta["context"]["actual_start_time"] = request_meta["start_time"]
+    request_meta["context"]["schedule_lag"] = schedule_lag
+    request_meta["start_time"] -= schedule_lag
+    request_meta["response_time"] += schedule_lag * 1000
 
-    def replace_url_variables(self, url):
-        """ Replaces placeholders in URL """
+class ArrivalSchedule:
+    """ Per-process open model clock, one greenlet queues intended start times at a fixed rate """
+
+    def __init__(self):
+        self.interval = None
+        self.last_slot = None
+        self.slots = Queue()
+        self.greenlet = None
+        self.fired = 0
+        self.late = 0
+        self.dropped = 0
+        self.max_lag = 0.0
+
+    def set_rate(self, rate):
+        """ Changes this process' requests per second, 0 pauses the schedule """
+        interval = 1.0 / rate if rate > 0 else None
+        if interval and self.interval and interval < self.interval and self.last_slot is not None:
+            # The shorter interval starts now, otherwise the slots between the last one and now count as late
+            self.last_slot = max(self.last_slot, time.perf_counter() - interval)
+        self.interval = interval
+
+    def start(self):
+        if self.greenlet is None:
+            self.greenlet = gevent.spawn(self.run)
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill(block=False)
+            self.greenlet = None
+        self.interval = self.last_slot = None
+        self.slots = Queue()
+
+    def run(self):
+        """ Queues a slot every interval, slots nobody picks up in time wait as backlog up to ARRIVAL_MAX_BACKLOG """
+        while True:
+            if self.interval is None:
+                self.last_slot = None
+                gevent.sleep(ARRIVAL_IDLE_SLEEP)
+                continue
+            now = time.perf_counter()
+            slot = now if self.last_slot is None else self.last_slot + self.interval
+            if slot > now:
+                # Short naps so a rate change applies to the next slot instead of after a long interval
+                gevent.sleep(min(slot - now, ARRIVAL_IDLE_SLEEP))
+                continue
+            self.last_slot = slot
+            if self.slots.qsize() >= max(ARRIVAL_MAX_BACKLOG / self.interval, 1):
+                self.dropped += 1
+            else:
+                self.slots.put(slot)
+
+    def next_slot(self):
+        """ Blocks until the next intended start time (perf_counter based) is due """
+        return self.slots.get()
+
+    def record(self, lag):
+        """ Tracks how late a slot actually started """
+        self.fired += 1
+        if lag > ARRIVAL_LATE_THRESHOLD:
+            self.late += 1
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+    def print_summary(self):
+        if self.fired or self.dropped:
+            print(f"Arrival schedule: {self.fired} requests, {self.late} started more than "
+                  f"{ARRIVAL_LATE_THRESHOLD * 1000:.0f}ms late, max lag {self.max_lag * 1000:.0f}ms, "
+                  f"{self.dropped} dropped over a {ARRIVAL_MAX_BACKLOG}s backlog")
+
+@task
+def run_arrival_slot(user):
+    """ Waits for the next schedule slot and fires one randomly picked collection request """
+    schedule = user.arrival_schedule
+    slot = schedule.next_slot()
+    schedule.record(time.perf_counter() - slot)
+    user.intended_start = slot
+    try:
+        random.choice(user.request_plan.tasks)(user)
+    finally:
+        user.intended_start = None
+
+def parse_arrival_stages(stages, rate):
+    """ Parses 'seconds:rate,...' ramp stages, a plain rate becomes one open-ended stage """
+    if not stages:
+        return [(None, float(rate))]
+    parsed = []
+    for stage in stages.split(','):
+        duration, stage_rate = stage.split(':')
+        parsed.append((float(duration), float(stage_rate)))
+    return parsed
+
+BODY_CHUNK_SIZE = 64 * 1024
+
+def iter_raw_body(response):
+    """ Yields a streamed body as it arrives on the wire, without content or charset decoding """
+    if isinstance(response, FastResponse):
+        return response.iter_content(BODY_CHUNK_SIZE, decode_content=False)
+    return response.raw.stream(BODY_CHUNK_SIZE, decode_content=False)
+
+def finish_streamed_body(response, keep=0):
+    """ Drains a streamed body keeping at most `keep` bytes, and books the full download in the stats """
+    kept = []
+    size = 0
+    for chunk in iter_raw_body(response):
+        if size < keep:
+            kept.append(chunk[:keep - size])
+        size += len(chunk)
+    # With stream=True locust stops the clock at the headers, include the body like the buffered mode does
+    request_meta = response.request_meta
+    request_meta["response_time"] = (time.time() - request_meta["start_time"]) * 1000
+    request_meta["response_length"] = size
+    return b''.join(kept)
+
+def read_failure_body(response, limit, stream):
+    """ Returns at most `limit` bytes of a failed response body as text """
+    if not stream:
+        # Already buffered, but decoding is bounded too: cut the bytes before they become text
+        return (response.content or b'')[:limit].decode('utf-8', errors='replace')
+    if isinstance(response, FastResponse) and getattr(response, 'error', None) is not None:
+        # geventhttpclient already buffered and decompressed the body when it saw the error status
+        return response.content[:limit].decode('utf-8', errors='replace')
+    data = finish_streamed_body(response, keep=limit)
+    content_encoding = (response.headers or {}).get('Content-Encoding', '').lower()
+    if content_encoding in ('gzip', 'deflate'):
+        # A truncated stream still decompresses up to where it was cut
         try:
-            url = replace_placeholders(url)
-            for key, value in self.url_variables.items():
-                url = url.replace(f"{{{{{key}}}}}", value)
-            return url
-        except KeyError as e:
-            error_message = f"KeyError: '{e.args[0]}' not found in the URL or variables."
-            if error_message not in self.seen_errors:
-                self.seen_errors.add(error_message)
+            data = zlib.decompressobj(wbits=47).decompress(data, limit)
+        except zlib.error:
+            if content_encoding != 'deflate':
+                raise
+            # Some servers send 'deflate' as a raw stream without the zlib header
+            data = zlib.decompressobj(wbits=-15).decompress(data, limit)
+    elif content_encoding and content_encoding != 'identity':
+        return f"<{content_encoding} encoded body>"
+    return data.decode('utf-8', errors='replace')
+
+class ErrorAggregator:
+    """ Error summary with a fixed memory budget, mergeable across workers """
+    OTHER = '<other>'
+
+    def __init__(self, max_fingerprints=ERROR_SUMMARY_MAX_FINGERPRINTS, max_samples=ERROR_SUMMARY_SAMPLES,
+                 sample_size=ERROR_SAMPLE_SIZE):
+        self.max_fingerprints = max_fingerprints
+        self.max_samples = max_samples
+        self.sample_size = sample_size
+        # (method, name, status, normalized body prefix) -> [count, samples]
+        self.entries = {}
+        self.print_on_quit = False  # Set on a master whose workers still send their last reports
+
+    @staticmethod
+    def normalize(body):
+        """ Reduces a body to a short prefix where ids, numbers and whitespace runs compare equal """
+        prefix = ERROR_VOLATILE_PATTERN.sub('#', body[:ERROR_FINGERPRINT_SIZE * 2])
+        return ' '.join(prefix.split())[:ERROR_FINGERPRINT_SIZE]
+
+    def record(self, method, name, status, body):
+        """ Counts one failed response """
+        self.add((method, name, status, self.normalize(body)), 1, (body,))
+
+    def add(self, fingerprint, count, samples):
+        """ Adds occurrences of a fingerprint, folding new ones into a per-status overflow bucket once full """
+        entry = self.entries.get(fingerprint)
+        if entry is None:
+            if len(self.entries) >= self.max_fingerprints:
+                fingerprint = ('', self.OTHER, fingerprint[2], '')
+                entry = self.entries.get(fingerprint)
+            if entry is None:
+                entry = self.entries[fingerprint] = [0, []]
+        entry[0] += count
+        for sample in samples:
+            if len(entry[1]) >= self.max_samples:
+                break
+            entry[1].append(sample[:self.sample_size])
+
+    def pop_delta(self):
+        """ Returns the recorded errors as a compact, serializable list and starts over """
+        delta = [[*fingerprint, count, samples] for fingerprint, (count, samples) in self.entries.items()]
+        self.entries = {}
+        return delta
+
+    def merge(self, delta):
+        """ Merges a list produced by pop_delta, typically sent by a worker """
+        for method, name, status, prefix, count, samples in delta:
+            self.add((method, name, status, prefix), count, samples)
+
+    def print_summary(self):
+        """ Prints errors grouped by status code, most frequent first """
+        if not self.entries:
+            return
+        by_status = defaultdict(list)
+        for (method, name, status, _), (count, samples) in self.entries.items():
+            by_status[status].append((count, method, name, samples))
+        print("\nError Summary:")
+        for status_code in sorted(by_status):
+            print(f"{status_code} Errors:")
+            for count, method, name, samples in sorted(by_status[status_code], key=lambda row: -row[0]):
+                label = f"{method} {name}".strip()
+                print(f" - {label} ({count}x)")
+                for sample in samples:
+                    print(f"     Response: {sample}")
+
+def get_error_aggregator(environment):
+    """ Returns the error aggregator of an environment, creating it on first use """
+    error_aggregator = getattr(environment, 'error_aggregator', None)
+    if error_aggregator is None:
+        error_aggregator = environment.error_aggregator = ErrorAggregator()
+    return error_aggregator
+
+class PhaseClock:
+    """ Splits one collection task into phases, each lap books the time since the previous one """
+    __slots__ = ('profiler', 'name', 'last')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.last = time.perf_counter_ns()
+
+    def lap(self, phase):
+        now = time.perf_counter_ns()
+        self.profiler.record(self.name, phase, now - self.last)
+        self.last = now
+
+    def finish(self):
+        """ Books locust's own reporting after the response block and ends the task """
+        self.lap('report')
+        self.profiler.running.pop(gevent.getcurrent(), None)
+
+class PhaseProfiler:
+    """ Fixed-size histograms of client time per request name and task phase, mergeable across workers """
+
+    def __init__(self):
+        # (name, phase) -> counts per PHASE_BUCKETS bound, the overflow count, then the sum in nanoseconds
+        self.histograms = {}
+        self.running = {}  # greenlet -> request name of the task it runs, roots the sampled stacks
+        self.print_on_quit = False  # Set on a master whose workers still send their last reports
+
+    def clock(self, name):
+        self.running[gevent.getcurrent()] = name
+        return PhaseClock(self, name)
+
+    def record(self, name, phase, elapsed_ns):
+        histogram = self.histograms.get((name, phase))
+        if histogram is None:
+            histogram = self.histograms[(name, phase)] = [0] * (len(PHASE_BUCKETS_NS) + 2)
+        histogram[bisect_left(PHASE_BUCKETS_NS, elapsed_ns)] += 1
+        histogram[-1] += elapsed_ns
+
+    def pop_delta(self):
+        """ Returns the histograms as a serializable list and starts over """
+        delta = [[name, phase, histogram] for (name, phase), histogram in self.histograms.items()]
+        self.histograms = {}
+        return delta
+
+    def merge(self, delta):
+        """ Adds a list produced by pop_delta, typically sent by a worker """
+        for name, phase, counts in delta:
+            histogram = self.histograms.setdefault((name, phase), [0] * len(counts))
+            for index, count in enumerate(counts):
+                histogram[index] += count
+
+    def render_metrics(self):
+        """ Prometheus histogram lines of locust_phase_duration_seconds """
+        lines = [
+            '# HELP locust_phase_duration_seconds Client time per collection task phase',
+            '# TYPE locust_phase_duration_seconds histogram',
+        ]
+        for (name, phase), histogram in sorted(self.histograms.items()):
+            labels = f'name="{escape_label(name, 200)}",phase="{phase}"'
+            cumulative = 0
+            for bound, count in zip(PHASE_BUCKETS, histogram):
+                cumulative += count
+                lines.append(f'locust_phase_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            count = cumulative + histogram[-2]
+            lines += [
+                f'locust_phase_duration_seconds_bucket{{{labels},le="+Inf"}} {count}',
+                f'locust_phase_duration_seconds_sum{{{labels}}} {histogram[-1] / 1e9}',
+                f'locust_phase_duration_seconds_count{{{labels}}} {count}',
+            ]
+        return lines
+
+    def print_summary(self, limit=PROFILE_SUMMARY_NAMES):
+        """ Prints the average time per phase of the requests with the most client time """
+        if not self.histograms:
+            return
+        totals = defaultdict(dict)
+        for (name, phase), histogram in self.histograms.items():
+            totals[name][phase] = (sum(histogram[:-1]), histogram[-1])
+        phases = [phase for phase in PHASES if any(phase in by_phase for by_phase in totals.values())]
+        spent = {phase: sum(by_phase.get(phase, (0, 0))[1] for by_phase in totals.values()) for phase in phases}
+        all_time = sum(spent.values()) or 1
+        # Hottest first by client time, the network wait inside 'request' would otherwise dominate the order
+        hottest = sorted(totals, key=lambda name: -sum(total for phase, (count, total) in totals[name].items()
+                                                      if phase != 'request'))[:limit]
+        print("\nClient time per phase (average microseconds):")
+        print(f"{'Name':<60}" + ''.join(f"{phase:>18}" for phase in phases))
+        for name in hottest:
+            cells = []
+            for phase in phases:
+                count, total = totals[name].get(phase, (0, 0))
+                cells.append(f"{total / count / 1000:>18.1f}" if count else f"{'-':>18}")
+            print(f"{name[:59]:<60}" + ''.join(cells))
+        print(f"{'Share of all task time':<60}" + ''.join(f"{spent[phase] / all_time:>18.1%}" for phase in phases))
+
+class StackSampler:
+    """ Statistical CPU profiler: folds the running stack every interval of process CPU time (SIGPROF) """
+
+    def __init__(self, profiler, path, interval=PROFILE_SAMPLE_INTERVAL):
+        self.profiler = profiler
+        self.path = path
+        self.interval = interval
+        self.stacks = defaultdict(int)
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def sample(self, signum, frame):
+        # Runs in whichever greenlet held the CPU when the timer fired
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        name = self.profiler.running.get(gevent.getcurrent())
+        frames.append(f"[{name}]".replace(';', ',') if name else '[locust]')
+        self.stacks[';'.join(reversed(frames))] += 1
+
+    def write(self, limit=PROFILE_SUMMARY_NAMES):
+        """ Saves the folded stacks (flamegraph.pl, speedscope) and prints the tasks with the most samples """
+        if not self.stacks:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as file:
+                for stack, count in sorted(self.stacks.items()):
+                    file.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"Error writing profile samples: {str(e)}")
+            return
+        by_task = defaultdict(int)
+        for stack, count in self.stacks.items():
+            by_task[stack.split(';', 1)[0]] += count
+        samples = sum(by_task.values())
+        print(f"\nCPU samples ({samples} every {self.interval * 1000:g} ms of CPU) written to {self.path}:")
+        for task_name, count in sorted(by_task.items(), key=lambda row: -row[1])[:limit]:
+            print(f"  {count / samples:>6.1%}  {task_name}")
+
+def setup_phase_profiler(environment, runner, sample_path):
+    """ Creates the profiler of this process and wires its reports, summary and optional stack sampler """
+    profiler = environment.phase_profiler = PhaseProfiler()
+    if isinstance(runner, WorkerRunner):
+        @environment.events.report_to_master.add_listener
+        def on_report_to_master(client_id, data):
+            data['phase_profile'] = profiler.pop_delta()
+
+        @environment.events.test_stop.add_listener
+        def on_worker_test_stop(environment, **kwargs):
+            runner.send_message('phase_profile', profiler.pop_delta())
+    else:
+        @environment.events.test_start.add_listener
+        def on_profile_test_start(environment, **kwargs):
+            if profiler.print_on_quit:
+                profiler.print_summary()
+                profiler.print_on_quit = False
+            profiler.histograms = {}
+
+        @environment.events.test_stop.add_listener
+        def on_profile_test_stop(environment, **kwargs):
+            if isinstance(runner, MasterRunner) and runner.worker_count:
+                # Like the error summary, wait for the workers' last reports
+                profiler.print_on_quit = True
+            else:
+                profiler.print_summary()
+
+        @environment.events.quit.add_listener
+        def on_profile_quit(**kwargs):
+            if profiler.print_on_quit:
+                profiler.print_summary()
+                profiler.print_on_quit = False
+
+    if isinstance(runner, MasterRunner):
+        runner.register_message('phase_profile', lambda msg, **kwargs: profiler.merge(msg.data))
+
+        @environment.events.worker_report.add_listener
+        def on_worker_report(client_id, data):
+            profiler.merge(data.get('phase_profile', ()))
+    elif sample_path:
+        if not hasattr(signal, 'setitimer'):
+            print("--profile-sample needs SIGPROF, not available on this platform")
+            return profiler
+        if isinstance(runner, WorkerRunner):
+            # One file per worker process
+            root, extension = os.path.splitext(sample_path)
+            sample_path = f"{root}.{os.getpid()}{extension}"
+        sampler = StackSampler(profiler, sample_path)
+        environment.events.test_start.add_listener(lambda **kwargs: sampler.start())
+
+        @environment.events.test_stop.add_listener
+        def on_sampler_test_stop(environment, **kwargs):
+            sampler.stop()
+            sampler.write()
+    return profiler
+
+_request_plans = {}
+
+
+def compiled_module_path(collection_file, namer, columns=()):
+    """ Returns where the generated module for this collection content, naming and feeder is cached """
+    with open(collection_file, 'rb') as f:
+        digest = hashlib.sha256(f.read())
+    # Request names and feeder slots are baked into the generated code, so they are part of the key
+    digest.update(f"{COMPILER_VERSION}:{namer.mode}:{namer.max_names}:{','.join(columns)}".encode('utf-8'))
+    stem = re.sub(r'\W+', '_', os.path.basename(collection_file).split('.')[0]).strip('_').lower()
+    return os.path.join(COMPILED_DIR, f"{stem}_{digest.hexdigest()[:16]}.py")
+
+class FolderTaskSet(TaskSet):
+    """ Runs the requests of one collection folder, generated tasks read user settings through it """
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+class FolderScenario(SequentialTaskSet, FolderTaskSet):
+    """ Runs one collection folder in order as a flow, then hands control back to the user """
+    folder = None
+
+    def on_start(self):
+        # Every pass starts from the collection defaults, like a fresh Postman run
+        self.user.variables = dict(self.user.request_plan.variables)
+        self._task_cycle = iter(self.tasks)
+
+    def get_next_task(self):
+        next_task = next(self._task_cycle, None)
+        if next_task is None:
+            self.interrupt()
+        return next_task
+
+class CompiledPlan:
+    """ Request plan imported from a module generated by `python postmantolocust.py compile` """
+
+    def __init__(self, collection_file, path, report_errors=True):
+        # Generated modules import their helpers from here, whatever name locust loaded us under
+        sys.modules.setdefault('locustfile', sys.modules[__name__])
+        spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        self.collection_file = collection_file
+        self.path = path
+        self.base_url = module.BASE_URL
+        self.requests = module.REQUESTS
+        self.tasks = module.TASKS
+        self.folders = module.FOLDERS
+        self.variables = module.VARIABLES
+        self.scenarios = module.SCENARIOS
+        self.load_errors = set(module.LOAD_ERRORS)
+        if report_errors:
+            # Same report as a runtime compile, the cached module would otherwise hide it
+            for error_message in module.LOAD_ERRORS:
                 print(error_message)
-            return url
 
-    def check_response_time(self, response):
-        """ Checks response time """
-        if response.elapsed.total_seconds() > MAX_RESPONSE_TIME:
-            response.failure(f"Response time exceeded {MAX_RESPONSE_TIME} seconds.")
+class Feeder:
+    """ Hands out rows of a CSV or JSONL file read through mmap, each process only reads its own byte range """
+
+    def __init__(self, path, mode='sequential'):
+        self.path = path
+        self.mode = mode
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+        self.jsonl = path.lower().endswith(('.jsonl', '.ndjson'))
+        self.data_start = 0
+        if self.jsonl:
+            first_row = self.parse(self.read_line(0)[0])
+            self.columns = tuple(first_row) if first_row else ()
         else:
-            response.success()
+            header, self.data_start = self.read_line(0)
+            self.columns = tuple(next(csv.reader([header.decode('utf-8-sig')]), []))
+        self.released = 0
+        self.exhausted = False
+        self.set_partition(0, 1)
+
+    def set_partition(self, index, count):
+        """ Restricts this process to the index-th of count equal byte ranges, aligned to whole lines, none if count is 0 """
+        if not count:
+            self.start = self.end = self.cursor = self.data_start
+            self.exhausted = False
+            return
+        size = len(self.map) - self.data_start
+        self.start = self.line_start(self.data_start + size * index // count)
+        self.end = self.line_start(self.data_start + size * (index + 1) // count)
+        self.cursor = self.start
+        self.exhausted = False
+
+    def line_start(self, offset):
+        """ Returns the offset of the first line starting at or after offset """
+        if offset <= self.data_start:
+            return self.data_start
+        newline = self.map.find(b'\n', offset - 1)
+        return len(self.map) if newline == -1 else newline + 1
+
+    def read_line(self, offset):
+        """ Returns the line at offset without its newline, and where the next line starts """
+        newline = self.map.find(b'\n', offset)
+        end = len(self.map) if newline == -1 else newline + 1
+        return self.map[offset:end].rstrip(b'\r\n'), end
 
-class WebUser(User):
+    def parse(self, line):
+        if not line.strip():
+            return None
+        if self.jsonl:
+            return json.loads(line)
+        return dict(zip(self.columns, next(csv.reader([line.decode('utf-8')]))))
+
+    def next_row(self):
+        """ Returns the next row for a request: in file order, random, or each row once ('unique') """
+        for _ in range(FEEDER_MAX_BLANK_LINES):
+            if self.start >= self.end:
+                self.stop_user("has no rows for this process")
+            if self.mode == 'random':
+                offset = self.line_start(random.randrange(self.start, self.end))
+                if offset >= self.end:
+                    offset = self.start
+                line, _ = self.read_line(offset)
+            else:
+                if self.cursor >= self.end:
+                    if self.mode == 'unique':
+                        self.stop_user("is exhausted")
+                    self.cursor = self.start
+                line, self.cursor = self.read_line(self.cursor)
+            self.release(len(line))
+            row = self.parse(line)
+            if row is not None:
+                return row
+        raise ValueError(f"Feeder {self.path} has more than {FEEDER_MAX_BLANK_LINES} blank lines in a row")
+
+    def release(self, size):
+        """ Drops mapped pages from RSS every FEEDER_RELEASE_BYTES, they are read back from the page cache """
+        self.released += size
+        if self.released >= FEEDER_RELEASE_BYTES and hasattr(mmap, 'MADV_DONTNEED'):
+            self.map.madvise(mmap.MADV_DONTNEED)
+            self.released = 0
+
+    def stop_user(self, reason):
+        if not self.exhausted:
+            self.exhausted = True
+            print(f"Feeder {self.path} {reason}, stopping users that need a row")
+        raise StopUser()
+
+def get_request_plan(collection_file=COLLECTION_FILE_NAME, namer=None, columns=()):
+    """ Returns the process-wide plan for a collection, importing its generated module if one is cached """
+    plan = _request_plans.get(collection_file)
+    if plan is None:
+        namer = namer or RequestNamer()
+        path = compiled_module_path(collection_file, namer, columns)
+        if os.path.exists(path):
+            plan = CompiledPlan(collection_file, path)
+        else:
+            plan = RequestPlan(collection_file, namer, columns)
+        _request_plans[collection_file] = plan
+    return plan
+
+
+def check_response_time(response):
+    """ Checks response time """
+    # request_meta is filled the same way by HttpUser and FastHttpUser
+    if response.request_meta["response_time"] / 1000.0 > MAX_RESPONSE_TIME:
+        response.failure(f"Response time exceeded {MAX_RESPONSE_TIME} seconds.")
+    else:
+        response.success()
+
+
+class AssetParser(HTMLParser):
+    """ Collects the sub-resources a browser would fetch while loading a page """
+
+    def __init__(self, page_url):
+        super().__init__(convert_charrefs=True)
+        self.page_url = page_url
+        self.assets = {}  # Ordered set of absolute URLs
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ASSET_TAGS:
+            return
+        attrs = dict(attrs)
+        if tag == 'link':
+            rel = (attrs.get('rel') or '').lower().split()
+            url = attrs.get('href') if ASSET_LINK_RELS.intersection(rel) else None
+        elif tag == 'base':
+            if attrs.get('href'):
+                self.page_url = urljoin(self.page_url, attrs['href'])
+            return
+        else:
+            url = attrs.get('src')
+        if url:
+            url = urljoin(self.page_url, url.strip())
+            if url.startswith(('http://', 'https://')):
+                self.assets[url.split('#', 1)[0]] = None
+
+
+def page_assets(page_url, html):
+    """ Absolute URLs of the stylesheets, scripts, images and icons a page references """
+    parser = AssetParser(page_url)
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        logging.warning(f"Could not parse assets of {page_url}: {e}")
+    return list(parser.assets)
+
+
+CacheEntry = namedtuple('CacheEntry', 'expires etag last_modified assets')
+
+
+class AssetCache:
+    """ Per-user HTTP cache: fresh entries skip the request, stale ones are revalidated """
+
+    def __init__(self, max_entries=ASSET_CACHE_ENTRIES):
+        self.entries = {}
+        self.max_entries = max_entries
+
+    def lookup(self, url):
+        """ Returns (entry, fresh) for a cached URL, (None, False) otherwise """
+        entry = self.entries.get(url)
+        if entry is None:
+            return None, False
+        return entry, entry.expires > time.time()
+
+    def store(self, url, response, assets=None, entry=None):
+        """ Keeps the response's freshness and validators, merged into entry on a 304 """
+        headers = response.headers
+        cache_control = {}
+        for directive in (headers.get('Cache-Control') or '').lower().split(','):
+            key, _, value = directive.strip().partition('=')
+            cache_control[key] = value.strip('"')
+        if 'no-store' in cache_control:
+            self.entries.pop(url, None)
+            return
+        expires = 0.0  # Revalidate on every use
+        if 'no-cache' not in cache_control:
+            if cache_control.get('max-age', '').isdigit():
+                expires = time.time() + int(cache_control['max-age'])
+            elif headers.get('Expires'):
+                try:
+                    expires = parsedate_to_datetime(headers['Expires']).timestamp()
+                except (TypeError, ValueError):
+                    pass
+        etag = headers.get('ETag') or (entry.etag if entry else None)
+        last_modified = headers.get('Last-Modified') or (entry.last_modified if entry else None)
+        if assets is None and entry:
+            assets = entry.assets
+        if expires <= time.time() and not etag and not last_modified:
+            self.entries.pop(url, None)  # Neither fresh nor revalidatable
+            return
+        self.entries.pop(url, None)
+        if len(self.entries) >= self.max_entries:
+            del self.entries[next(iter(self.entries))]
+        self.entries[url] = CacheEntry(expires, etag, last_modified, assets)
+
+
+class WebUser(HttpUser):
+    """ Loads pages like a browser: assets in parallel over a few connections, cached between loads """
     wait_time = between(1, 5)
     host = "http://localhost"
 
     def on_start(self):
         """Web kullanıcısı başlatıldığında çalışır"""
-        self.client.headers = {
+        self.client.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
+        })
+        # One keep-alive pool per host, as large as the number of parallel asset fetches
+        adapter = LocustHttpAdapter(pool_manager=None, pool_connections=ASSET_POOL_HOSTS,
+                                    pool_maxsize=ASSET_CONCURRENCY)
+        self.client.mount("https://", adapter)
+        self.client.mount("http://", adapter)
+        self.asset_pool = Pool(ASSET_CONCURRENCY)
+        self.cache = AssetCache()
 
     @task
     def load_homepage(self):
-        """Ana sayfayı yükle"""
-        with self.client.get("/", catch_response=True) as response:
-            if response.status_code == 200:
-                response.success()
-            else:
-                response.failure(f"Status code: {response.status_code}")
+        """Ana sayfayı ve referans verdiği kaynakları yükle"""
+        self.load_page("/")
 
     @task
     def load_static_resources(self):
         """Statik kaynakları yükle (CSS, JS, images)"""
-        static_resources = [
-            "/static/css/main.css",
-            "/static/js/app.js",
-            "/static/images/logo.png"
-        ]
-        for resource in static_resources:
-            with self.client.get(resource, catch_response=True) as response:
-                if response.status_code == 200:
-                    response.success()
-                else:
-                    response.failure(f"Status code: {response.status_code}")
-
-class APITestUser(HttpUser):
+        self.load_page(None, STATIC_RESOURCES)
+
+    def load_page(self, path, assets=()):
+        """ Fetches a page and its assets, then reports the whole load as one PAGE request """
+        start = time.perf_counter()
+        if path is not None:
+            ok, downloaded, assets = self.fetch(path, page=True)
+            failures = [] if ok else [path]
+        else:
+            downloaded, failures = 0, []
+        fetches = [self.asset_pool.spawn(self.fetch, asset) for asset in assets]
+        gevent.joinall(fetches)
+        for fetch, asset in zip(fetches, assets):
+            ok, size, _ = fetch.value if fetch.successful() else (False, 0, ())
+            downloaded += size
+            if not ok:
+                failures.append(asset)
+        self.environment.events.request.fire(
+            request_type="PAGE",
+            name=path if path is not None else "static resources",
+            response_time=(time.perf_counter() - start) * 1000,
+            response_length=downloaded,
+            exception=CatchResponseError(f"{failures[0]} failed to load") if failures else None,
+            context={},
+        )
+
+    def fetch(self, url, page=False):
+        """ GETs url through the cache, returns (ok, downloaded bytes, assets of a page) """
+        absolute = url if url.startswith(('http://', 'https://')) else f"{self.client.base_url}{url}"
+        entry, fresh = self.cache.lookup(absolute)
+        if fresh:
+            return True, 0, entry.assets or ()
+        headers = {}
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        parsed = urlparse(absolute)
+        name = parsed.path if absolute.startswith(self.host) else f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+        with self.client.get(absolute, name=name or "/", headers=headers, catch_response=True) as response:
+            if response.status_code == 304 and entry:
+                response.success()
+                self.cache.store(absolute, response, entry=entry)
+                return True, 0, entry.assets or ()
+            if response.status_code != 200:
+                response.failure(f"Status code: {response.status_code}")
+                return False, len(response.content or b''), ()
+            response.success()
+            assets = ()
+            if page and 'html' in response.headers.get('Content-Type', ''):
+                assets = page_assets(response.url or absolute, response.text)
+            self.cache.store(absolute, response, assets)
+            return True, len(response.content), assets
+
+class CollectionUserMixin:
+    """ Runs the compiled collection tasks, independent of the HTTP client backend """
     wait_time = between(1, 5)
     host = "https://www.obilet.com"  # Default host, will be updated from collection variables
     tasks = []
+    stream_responses = False  # True: drain successful bodies without reading them into memory
+    failure_body_limit = 2048  # Bytes of a failed response kept for error messages
+    arrival_schedule = None  # Set in arrival-rate mode, users then fire on the shared schedule
+    feeder = None  # Set with --feeder, requests using {{column}} placeholders take a row each
+    intended_start = None
+    task_order = 'random'  # 'sequential' runs each folder as a flow, values extracted by one step feed the next
 
     def on_start(self):
-        """ Loads dynamic task set when test starts """
-        self.dynamic_task_set = DynamicTaskSet(self)
-        self.tasks = [task for _, task in self.dynamic_task_set.tasks]
-        self.environment.dynamic_task_set = self.dynamic_task_set
-        # Update host from baseUrl variable if available
-        if hasattr(self.dynamic_task_set, 'base_url'):
-            self.host = self.dynamic_task_set.base_url
-            self.environment.host = self.dynamic_task_set.base_url
+        """ Binds the shared request plan to this user """
+        self.request_plan = get_request_plan()
+        self.variables = dict(self.request_plan.variables)
+        if self.arrival_schedule:
+            self.tasks = [run_arrival_slot]
+        elif self.task_order == 'sequential':
+            self.tasks = self.request_plan.scenarios
+        else:
+            self.tasks = self.request_plan.tasks
+        self.error_aggregator = get_error_aggregator(self.environment)
 
     @events.test_start.add_listener
     def on_test_start(environment, **kwargs):
@@ -326,7 +1898,7 @@ class APITestUser(HttpUser):
             logging.basicConfig(
                 filename=LOG_FILE,
                 level=logging.INFO,
-                format='[%(asctime)s] %(levelname)s: %(message)s',
+                format=LOG_FORMAT,
                 filemode='w'
             )
             logging.info("Test Started")
@@ -338,17 +1910,18 @@ class APITestUser(HttpUser):
     def on_test_stop(environment, **kwargs):
         """ Called when test ends """
         print("Test Ended")
-        dynamic_task_set = getattr(environment, 'dynamic_task_set', None)
-        if dynamic_task_set and dynamic_task_set.error_summary:
-            print("\nError Summary:")
-            for status_code, messages in dynamic_task_set.error_summary.items():
-                print(f"{status_code} Errors:")
-                for message in messages:
-                    print(f" - {message}")
+
+class APITestUser(CollectionUserMixin, HttpUser):
+    """ Collection user on python-requests """
+
+class FastAPITestUser(CollectionUserMixin, FastHttpUser):
+    """ Collection user on geventhttpclient, several times more requests per core """
 
 # Test tipine göre kullanılacak User sınıfını belirle
 if TEST_TYPE.lower() == 'client':
     UserClass = WebUser
+elif CLIENT_BACKEND.lower() == 'fast':
+    UserClass = FastAPITestUser
 else:
     UserClass = APITestUser
 
@@ -356,152 +1929,1053 @@ else:
 class TestUser(UserClass):
     pass
 
+USES_COLLECTION = issubclass(TestUser, CollectionUserMixin)
+
 # Expose only TestUser to Locust to avoid duplicate user class names
-del WebUser, APITestUser
+del WebUser, APITestUser, FastAPITestUser, UserClass
+
+class ArrivalRateShape(LoadTestShape):
+    """ Open model: drives a target request rate instead of a user count, -u caps concurrent requests """
+    # Only picked up by locust when an arrival rate is configured
+    abstract = not (USES_COLLECTION and (ARRIVAL_RATE or ARRIVAL_STAGES)) or bool(SLO_FILE)
+    use_common_options = True
+
+    def __init__(self):
+        super().__init__()
+        self.stages = parse_arrival_stages(ARRIVAL_STAGES, ARRIVAL_RATE or 0)
+        self.published = None
+
+    def reset_time(self):
+        super().reset_time()
+        self.published = None
+
+    def current_rate(self, run_time):
+        """ Returns the target rate at run_time, ramping linearly within each stage, None when done """
+        # Applied once per shape tick (1 second), so a ramp is a staircase of 1 second steps
+        previous_rate = 0.0
+        for duration, rate in self.stages:
+            if duration is None:
+                return rate
+            if run_time < duration:
+                return previous_rate + (rate - previous_rate) * run_time / duration
+            run_time -= duration
+            previous_rate = rate
+        return None
+
+    def tick(self):
+        options = self.runner.environment.parsed_options
+        run_time = self.get_run_time()
+        rate = self.current_rate(run_time)
+        if rate is None or (options and options.run_time and run_time > options.run_time):
+            return None
+        self.publish(rate)
+        users = (options.num_users if options else None) or ARRIVAL_DEFAULT_USERS
+        return users, users
+
+    def publish(self, rate):
+        """ Splits the rate across the load generators that run users """
+        runner = self.runner
+        if isinstance(runner, MasterRunner):
+            workers = runner.worker_count
+            if not workers or self.published == (rate, workers):
+                return
+            for worker in runner.clients.values():
+                runner.send_message('arrival_rate', rate / workers, client_id=worker.id)
+            self.published = (rate, workers)
+        elif self.published != rate:
+            self.runner.environment.arrival_schedule.set_rate(rate)
+            self.published = rate
+
+def load_slos(path):
+    """ Reads {'default': {...}, 'endpoints': {'METHOD name' or 'name': {...}}} SLOs from a JSON file """
+    with open(path, 'r', encoding='utf-8') as file:
+        slos = json.load(file)
+    targets = [slos.get('default', {}), *slos.get('endpoints', {}).values()]
+    unknown = {key for target in targets for key in target} - SLO_KEYS
+    if unknown:
+        raise ValueError(f"Unknown SLO keys in {path}: {', '.join(sorted(unknown))}")
+    return slos
+
+def window_percentile(response_times, count, percent):
+    """ Returns the percentile in ms of a {rounded ms: count} histogram, picked like locust's own percentiles """
+    target = int(count * percent)
+    below = 0
+    result = 0
+    for response_time in sorted(response_times):
+        if below > target:
+            break
+        result = response_time
+        below += response_times[response_time]
+    return result
+
+def snapshot_stats(stats):
+    """ Copies the counters a step window is measured against """
+    return {key: (entry.num_requests, entry.num_failures, dict(entry.response_times))
+            for key, entry in stats.entries.items()}
+
+class CapacitySearchShape(LoadTestShape):
+    """ Steps users up until an endpoint breaks its SLO and reports the last sustainable step per folder """
+    # Only picked up by locust when an SLO file is configured
+    abstract = not (USES_COLLECTION and SLO_FILE)
+    use_common_options = True
+
+    def __init__(self):
+        super().__init__()
+        self.slos = load_slos(SLO_FILE)
+        self.folders = {}
+        self.reset_time()
+
+    def reset_time(self):
+        super().reset_time()
+        self.step = 0
+        self.users = 0
+        self.step_start = 0.0
+        self.warming = False
+        self.snapshot = {}
+        self.steps = []
+        self.result = None
+
+    def tick(self):
+        if self.result:
+            return None
+        options = self.runner.environment.parsed_options
+        step_users = options.step_users if options else CAPACITY_STEP_USERS
+        step_time = options.step_time if options else CAPACITY_STEP_TIME
+        max_users = options.num_users if options and options.num_users else step_users * 10
+        spawn_rate = options.spawn_rate if options and options.spawn_rate else step_users
+        run_time = self.get_run_time()
+
+        if self.step:
+            if self.warming:
+                # The window starts once the step's users are spawned, so the ramp is not judged
+                if self.runner.user_count < self.users and run_time - self.step_start < step_time:
+                    return self.users, spawn_rate
+                self.warming = False
+                self.step_start = run_time
+                self.snapshot = snapshot_stats(self.runner.environment.stats)
+                return self.users, spawn_rate
+            if run_time - self.step_start < step_time:
+                return self.users, spawn_rate
+            # The step is judged once, at its end, stretched while low traffic endpoints collect samples
+            window = self.measure(run_time)
+            if window['unchecked'] and run_time - self.step_start < step_time * CAPACITY_MAX_STEP_STRETCH:
+                return self.users, spawn_rate
+            self.steps.append(window)
+            if window['breaches']:
+                self.result = 'slo_breached'
+                return None
+            if self.users >= max_users:
+                self.result = 'max_users_reached'
+                return None
+
+        self.step += 1
+        self.users = min(self.step * step_users, max_users)
+        self.step_start = run_time
+        self.warming = True
+        return self.users, spawn_rate
+
+    def measure(self, run_time):
+        """ Evaluates the current step window: throughput per folder and SLO breaches per endpoint """
+        if not self.folders:
+            for compiled in get_request_plan().requests:
+                key = (compiled.name, compiled.method.upper())
+                folders = self.folders.setdefault(key, set())
+                folders.add(compiled.folder or 'Unknown')
+        duration = max(run_time - self.step_start, 0.001)
+        folder_counts = defaultdict(int)
+        total = failures = 0
+        breaches = []
+        unchecked = []
+        for key, entry in self.runner.environment.stats.entries.items():
+            start_requests, start_failures, start_times = self.snapshot.get(key, (0, 0, {}))
+            count = entry.num_requests - start_requests
+            if count <= 0:
+                continue
+            window_failures = entry.num_failures - start_failures
+            response_times = {response_time: entry_count - start_times.get(response_time, 0)
+                              for response_time, entry_count in entry.response_times.items()
+                              if entry_count > start_times.get(response_time, 0)}
+            # A request shared by several folders counts a share towards each of them
+            folders = self.folders.get(key, ('other',))
+            for folder in folders:
+                folder_counts[folder] += count / len(folders)
+            total += count
+            failures += window_failures
+            if count < CAPACITY_MIN_SAMPLES and self.endpoint_slo(key):
+                unchecked.append(f"{key[1]} {key[0]} ({count} requests)")
+            breaches.extend(self.check_slo(key, count, window_failures, response_times))
+        return {
+            'step': self.step,
+            'users': self.users,
+            'duration': round(duration, 1),
+            'rps': round(total / duration, 2),
+            'error_rate': round(failures / total, 4) if total else 0.0,
+            'folders': {folder: round(count / duration, 2) for folder, count in sorted(folder_counts.items())},
+            'breaches': breaches,
+            # Endpoints with an SLO but under CAPACITY_MIN_SAMPLES requests in this window, their SLO was not judged
+            'unchecked': sorted(unchecked),
+        }
+
+    def endpoint_slo(self, key):
+        name, method = key
+        endpoints = self.slos.get('endpoints', {})
+        return endpoints.get(f"{method} {name}") or endpoints.get(name) or self.slos.get('default')
+
+    def check_slo(self, key, count, failures, response_times):
+        """ Returns the SLO breaches of one endpoint in the window, skipping endpoints with too few samples """
+        name, method = key
+        slo = self.endpoint_slo(key)
+        if not slo or count < CAPACITY_MIN_SAMPLES:
+            return []
+        breaches = []
+        error_rate = failures / count
+        if 'error_rate' in slo and error_rate > slo['error_rate']:
+            breaches.append(f"{method} {name}: error rate {error_rate:.2%} > {slo['error_rate']:.2%}")
+        samples = sum(response_times.values())
+        for percentile in ('p95', 'p99'):
+            if percentile in slo and samples:
+                value = window_percentile(response_times, samples, int(percentile[1:]) / 100) / 1000.0
+                if value > slo[percentile]:
+                    breaches.append(f"{method} {name}: {percentile} {value:.3f}s > {slo[percentile]}s")
+        return breaches
+
+    def write_report(self):
+        """ Prints the knee and the best passing step, and saves every step to CAPACITY_REPORT_FILE """
+        if not self.steps:
+            return
+        passed = [step for step in self.steps if not step['breaches']]
+        best = max(passed, key=lambda step: step['rps'], default=None)
+        knee = self.steps[-1] if self.steps[-1]['breaches'] else None
+        report = {
+            'result': self.result or 'stopped',
+            'max_sustainable': best,
+            'knee': knee,
+            'steps': self.steps,
+            'slo': self.slos,
+            'min_samples': CAPACITY_MIN_SAMPLES,
+        }
+        try:
+            os.makedirs(os.path.dirname(CAPACITY_REPORT_FILE), exist_ok=True)
+            with open(CAPACITY_REPORT_FILE, 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
+        except OSError as e:
+            print(f"Error writing capacity report: {str(e)}")
+
+        print(f"\nCapacity search: {report['result']}")
+        if knee:
+            print(f"SLO breached at {knee['users']} users (step {knee['step']}):")
+            for breach in knee['breaches']:
+                print(f"  {breach}")
+        if best:
+            print(f"Max sustainable: {best['users']} users, {best['rps']} req/s, error rate {best['error_rate']:.2%}")
+            for folder, rps in best['folders'].items():
+                print(f"  {folder}: {rps} req/s")
+            if best['unchecked']:
+                print(f"  {len(best['unchecked'])} endpoints had fewer than {CAPACITY_MIN_SAMPLES} requests even in the "
+                      f"stretched step and were not checked against their SLO, see 'unchecked' in the report")
+        else:
+            print("No step met the SLOs")
+        print(f"Report written to {CAPACITY_REPORT_FILE}")
 
-# Prometheus metrics exporter
 @events.init.add_listener
-def on_locust_init(environment, **kwargs):
-    """Add Prometheus metrics endpoint to Locust web UI"""
-    
-    def metrics_handler():
-        """Generate Prometheus metrics from Locust stats"""
-        stats = environment.stats
-        runner = environment.runner
-        
-        metrics = []
+def on_capacity_search_init(environment, runner=None, **kwargs):
+    """ Writes the capacity report when the search ends or the test is stopped by hand """
+    shape = environment.shape_class
+    if not isinstance(shape, CapacitySearchShape):
+        return
+
+    @environment.events.test_stop.add_listener
+    def on_capacity_test_stop(environment, **kwargs):
+        shape.write_report()
+
+class BenchProbe:
+    """ Measures the load generator itself: throughput per CPU second, memory per user and spawn time """
+
+    def __init__(self, environment, path):
+        self.environment = environment
+        self.path = path
+        self.process = psutil.Process()
+        self.started = None
+        self.spawned = None
+
+    def sample(self):
+        return {
+            'time': time.perf_counter(),
+            'cpu': sum(self.process.cpu_times()[:2]),
+            'rss': self.process.memory_info().rss,
+            'requests': self.environment.stats.total.num_requests,
+            'failures': self.environment.stats.total.num_failures,
+        }
+
+    def on_test_start(self, **kwargs):
+        self.started = self.sample()
+
+    def on_spawning_complete(self, user_count, **kwargs):
+        # Steady state starts here, spawning cost is reported on its own
+        self.spawned = dict(self.sample(), users=user_count)
+
+    def on_test_stop(self, **kwargs):
+        if not self.started or not self.spawned:
+            print("Bench: users never finished spawning, no report written")
+            return
+        stopped = self.sample()
+        spawned = self.spawned
+        requests = stopped['requests'] - spawned['requests']
+        cpu = stopped['cpu'] - spawned['cpu']
+        elapsed = stopped['time'] - spawned['time']
+        report = {
+            'users': spawned['users'],
+            'client_backend': CLIENT_BACKEND,
+            'duration': round(elapsed, 3),
+            'requests': requests,
+            'failures': stopped['failures'] - spawned['failures'],
+            'rps': round(requests / elapsed, 1) if elapsed else 0,
+            # What one fully busy core would sustain at the measured cost per request
+            'rps_per_core': round(requests / cpu, 1) if cpu else 0,
+            'cpu_ms_per_request': round(cpu * 1000 / requests, 4) if requests else None,
+            'cpu_utilization': round(cpu / elapsed, 3) if elapsed else 0,
+            'rss_mb_per_1000_users': round((stopped['rss'] - self.started['rss']) / 1024 / 1024 * 1000
+                                           / max(spawned['users'], 1), 2),
+            'rss_mb_peak': round(max(stopped['rss'], spawned['rss']) / 1024 / 1024, 1),
+            'spawn_seconds': round(spawned['time'] - self.started['time'], 3),
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+        except OSError as e:
+            print(f"Error writing bench report: {str(e)}")
+
+class RequestLog:
+    """ Records every request into a double-buffered ring, a background greenlet writes full batches from a thread """
+
+    def __init__(self, path, worker, sample=1.0):
+        self.path = path
+        self.worker = worker
+        self.sample = sample
+        self.buffer = bytearray(REQUEST_RECORD.size * REQUEST_LOG_BATCH)
+        self.offset = 0
+        self.names = {}
+        self.new_names = []
+        self.pending = []  # Frames waiting for the writer, at most REQUEST_LOG_PENDING batches
+        self.pending_batches = 0
+        self.written = 0
+        self.dropped = 0
+        self.file = None
+        self.writer = None
+        self.stopping = Event()
+
+    def start(self, **kwargs):
+        """ Opens the log for a new test run """
+        self.stop()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'wb')
+        header = json.dumps({'version': REQUEST_LOG_VERSION, 'worker': self.worker, 'sample': self.sample,
+                             'started': time.time()}).encode('utf-8')
+        self.write_file(REQUEST_LOG_MAGIC + REQUEST_LOG_FRAME.pack(b'H', len(header)) + header)
+        self.offset = self.written = self.dropped = 0
+        self.names = {}
+        self.new_names = []
+        self.stopping = Event()
+        self.writer = gevent.spawn(self.write_loop)
+
+    def on_request(self, request_type, name, response_time, response_length, response=None, exception=None,
+                   start_time=None, **kwargs):
+        """ request event listener, packs one record into the buffer """
+        if self.file is None or (self.sample < 1.0 and random.random() >= self.sample):
+            return
+        key = (request_type, name)
+        name_id = self.names.get(key)
+        if name_id is None:
+            name_id = self.names[key] = len(self.names)
+            self.new_names.append((name_id, request_type, name))
+        REQUEST_RECORD.pack_into(
+            self.buffer, self.offset, start_time or time.time(), response_time or 0, response_length or 0, name_id,
+            getattr(response, 'status_code', None) or 0, exception is not None,
+        )
+        self.offset += REQUEST_RECORD.size
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """ Hands the buffered records to the writer, dropping them if it is REQUEST_LOG_PENDING batches behind """
+        if self.new_names:
+            # Name frames are never dropped, later records still refer to them
+            names = json.dumps(self.new_names).encode('utf-8')
+            self.pending.append(REQUEST_LOG_FRAME.pack(b'N', len(names)) + names)
+            self.new_names = []
+        if not self.offset:
+            return
+        if self.pending_batches >= REQUEST_LOG_PENDING:
+            self.dropped += self.offset // REQUEST_RECORD.size
+        else:
+            self.pending.append(REQUEST_LOG_FRAME.pack(b'R', self.offset) + bytes(self.buffer[:self.offset]))
+            self.pending_batches += 1
+            self.written += self.offset // REQUEST_RECORD.size
+        self.offset = 0
+
+    def write_pending(self):
+        """ Writes the pending frames in one call on a native thread, so disk latency never blocks the loop """
+        if not self.pending:
+            return
+        data = b''.join(self.pending)
+        self.pending = []
+        self.pending_batches = 0
+        gevent.get_hub().threadpool.apply(self.write_file, (data,))
+
+    def write_file(self, data):
+        # Flushed after every batch, so a killed worker keeps what it wrote
+        self.file.write(data)
+        self.file.flush()
+
+    def write_loop(self):
+        """ Writes once per REQUEST_LOG_FLUSH_INTERVAL until stop(), never two writes at once """
+        while not self.stopping.wait(REQUEST_LOG_FLUSH_INTERVAL):
+            self.flush()
+            self.write_pending()
+
+    def stop(self, **kwargs):
+        """ Writes what is left and closes the log """
+        if self.file is None:
+            return
+        if self.writer is not None:
+            # Killing the greenlet would not stop a write already running on a thread, let it finish
+            self.stopping.set()
+            self.writer.join()
+            self.writer = None
+        self.flush()
+        self.write_pending()
+        self.file.close()
+        self.file = None
+        dropped = f", {self.dropped} dropped because the disk could not keep up" if self.dropped else ""
+        print(f"Request log: {self.written} records written to {self.path}{dropped}")
+
+
+def read_request_log(path):
+    """ Yields the records of a --request-log file as dicts """
+    with open(path, 'rb') as file:
+        if file.read(len(REQUEST_LOG_MAGIC)) != REQUEST_LOG_MAGIC:
+            raise ValueError(f"{path} is not a request log")
+        header = {}
+        names = {}
+        while True:
+            frame = file.read(REQUEST_LOG_FRAME.size)
+            if len(frame) < REQUEST_LOG_FRAME.size:
+                return
+            kind, length = REQUEST_LOG_FRAME.unpack(frame)
+            payload = file.read(length)
+            if len(payload) < length:
+                return  # Truncated by a killed process
+            if kind == b'H':
+                header = json.loads(payload)
+            elif kind == b'N':
+                for name_id, request_type, name in json.loads(payload):
+                    names[name_id] = (request_type, name)
+            elif kind == b'R':
+                for timestamp, latency, size, name_id, status, failed in REQUEST_RECORD.iter_unpack(payload):
+                    request_type, name = names[name_id]
+                    yield {'timestamp': round(timestamp, 6), 'type': request_type, 'name': name, 'status': status,
+                           'latency_ms': round(latency, 3), 'bytes': size, 'failed': bool(failed),
+                           'worker': header.get('worker')}
+
+def latency_bucket(microseconds):
+    """ Log-linear HDR bucket of a latency: exact below 2**(bits+1) us, then 2**bits buckets per power of two """
+    shift = max(0, microseconds.bit_length() - LATENCY_SIGNIFICANT_BITS - 1)
+    return (shift << LATENCY_SIGNIFICANT_BITS) + (microseconds >> shift)
+
+
+def bucket_microseconds(index):
+    """ Midpoint of the latencies that fall into a latency_bucket index """
+    shift = max(0, (index >> LATENCY_SIGNIFICANT_BITS) - 1)
+    return ((index - (shift << LATENCY_SIGNIFICANT_BITS)) << shift) + ((1 << shift) - 1) / 2
+
+
+def latency_at_rank(buckets, rank):
+    """ Latency in ms of the rank-th smallest sample (0-based) of sorted (bucket, count) pairs """
+    seen = 0
+    for index, count in buckets:
+        seen += count
+        if seen > rank:
+            return bucket_microseconds(index) / 1000.0
+    return bucket_microseconds(buckets[-1][0]) / 1000.0 if buckets else 0.0
+
+
+class LatencyHistograms:
+    """ High resolution latency histogram per request name, merged exactly across workers and runs """
+
+    def __init__(self):
+        self.histograms = {}  # (request type, name) -> [count, failures, {bucket: count}]
+        self.started = self.stopped = None
+        self.write_on_quit = False  # Set on a master whose workers still send their last reports
+
+    def on_request(self, request_type, name, response_time, exception=None, **kwargs):
+        """ request event listener """
+        histogram = self.histograms.get((request_type, name))
+        if histogram is None:
+            histogram = self.histograms[(request_type, name)] = [0, 0, defaultdict(int)]
+        histogram[0] += 1
+        if exception is not None:
+            histogram[1] += 1
+        histogram[2][latency_bucket(int((response_time or 0) * 1000))] += 1
+
+    def pop_delta(self):
+        """ Returns the histograms as a serializable list and starts over """
+        delta = [[request_type, name, count, failures, list(buckets.items())]
+                 for (request_type, name), (count, failures, buckets) in self.histograms.items()]
+        self.histograms = {}
+        return delta
+
+    def merge(self, delta):
+        """ Adds a list produced by pop_delta, typically sent by a worker """
+        for request_type, name, count, failures, buckets in delta:
+            histogram = self.histograms.get((request_type, name))
+            if histogram is None:
+                histogram = self.histograms[(request_type, name)] = [0, 0, defaultdict(int)]
+            histogram[0] += count
+            histogram[1] += failures
+            for index, bucket_count in buckets:
+                histogram[2][index] += bucket_count
+
+    def write(self, path):
+        """ Saves all histograms of the run into one JSON file, the input of 'postmantolocust.py compare' """
+        report = {
+            'version': LATENCY_HISTOGRAM_VERSION,
+            'significant_bits': LATENCY_SIGNIFICANT_BITS,
+            'started': self.started,
+            'duration': round((self.stopped or time.time()) - (self.started or time.time()), 3),
+            'requests': [
+                {'type': request_type, 'name': name, 'count': count, 'failures': failures,
+                 'buckets': sorted(buckets.items())}
+                for (request_type, name), (count, failures, buckets) in sorted(self.histograms.items())
+            ],
+        }
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(report, file, separators=(',', ':'))
+            print(f"Latency histograms of {len(self.histograms)} requests written to {path}")
+        except OSError as e:
+            print(f"Error writing latency histograms: {str(e)}")
+
+
+def load_latency_histograms(path):
+    """ Reads a --latency-histograms file into (duration, {'TYPE name': request entry}) """
+    with open(path, encoding='utf-8') as file:
+        report = json.load(file)
+    if report.get('significant_bits') != LATENCY_SIGNIFICANT_BITS:
+        raise ValueError(f"{path} uses {report.get('significant_bits')} significant bits, "
+                         f"expected {LATENCY_SIGNIFICANT_BITS}")
+    return report['duration'], {f"{entry['type']} {entry['name']}": entry for entry in report['requests']}
+
+
+def setup_latency_histograms(environment, runner, path):
+    """ Records histograms in every process, the master or local runner writes the merged file """
+    histograms = environment.latency_histograms = LatencyHistograms()
+    if isinstance(runner, WorkerRunner):
+        environment.events.request.add_listener(histograms.on_request)
+
+        @environment.events.report_to_master.add_listener
+        def on_report_to_master(client_id, data):
+            data['latency_histograms'] = histograms.pop_delta()
+
+        @environment.events.test_stop.add_listener
+        def on_worker_test_stop(environment, **kwargs):
+            runner.send_message('latency_histograms', histograms.pop_delta())
+        return histograms
+
+    @environment.events.test_start.add_listener
+    def on_histograms_test_start(environment, **kwargs):
+        histograms.histograms = {}
+        histograms.started = time.time()
+        histograms.stopped = None
+        histograms.write_on_quit = False
+
+    @environment.events.test_stop.add_listener
+    def on_histograms_test_stop(environment, **kwargs):
+        histograms.stopped = time.time()
+        if isinstance(runner, MasterRunner) and runner.worker_count:
+            # Like the error summary, wait for the workers' last reports
+            histograms.write_on_quit = True
+        else:
+            histograms.write(path)
+
+    @environment.events.quit.add_listener
+    def on_histograms_quit(**kwargs):
+        if histograms.write_on_quit:
+            histograms.write(path)
+
+    if isinstance(runner, MasterRunner):
+        runner.register_message('latency_histograms', lambda msg, **kwargs: histograms.merge(msg.data))
+
+        @environment.events.worker_report.add_listener
+        def on_worker_report(client_id, data):
+            histograms.merge(data.get('latency_histograms', ()))
+    else:
+        environment.events.request.add_listener(histograms.on_request)
+    return histograms
+
+@events.init.add_listener
+def on_bench_init(environment, runner=None, **kwargs):
+    """ Benchmarks the generator: fixed concurrency with no think time, metrics from this process only """
+    options = environment.parsed_options
+    if not options or not options.bench_report or not USES_COLLECTION:
+        return
+    if isinstance(runner, (MasterRunner, WorkerRunner)):
+        print("Bench: --bench-report measures a single local process, ignored in distributed runs")
+        return
+    # Every user keeps one request in flight, so concurrency is exactly -u
+    TestUser.wait_time = constant(0)
+    probe = BenchProbe(environment, options.bench_report)
+    environment.events.test_start.add_listener(probe.on_test_start)
+    environment.events.spawning_complete.add_listener(probe.on_spawning_complete)
+    environment.events.test_stop.add_listener(probe.on_test_stop)
+
+@events.init.add_listener
+def on_request_log_init(environment, runner=None, **kwargs):
+    """ Writes per-request records with --request-log, each worker to its own file """
+    options = environment.parsed_options
+    if not options or not options.request_log or isinstance(runner, MasterRunner):
+        return
+    if not 0 < options.request_log_sample <= 1:
+        print("--request-log-sample must be between 0 and 1, request log disabled")
+        return
+    path = options.request_log
+    worker = 'local'
+    if isinstance(runner, WorkerRunner):
+        root, extension = os.path.splitext(path)
+        path = f"{root}.{os.getpid()}{extension}"
+        worker = runner.client_id
+    request_log = environment.request_log = RequestLog(path, worker, options.request_log_sample)
+    environment.events.request.add_listener(request_log.on_request)
+    environment.events.test_start.add_listener(request_log.start)
+    environment.events.test_stop.add_listener(request_log.stop)
+    if isinstance(runner, WorkerRunner) and runner.worker_state in (STATE_SPAWNING, STATE_RUNNING):
+        # A worker joining a running test, e.g. one restarted by the launcher, can get its test_start before init
+        request_log.start()
+
+@events.init.add_listener
+def on_latency_histograms_init(environment, runner=None, **kwargs):
+    """ Keeps an HDR latency histogram per request name with --latency-histograms """
+    options = environment.parsed_options
+    if options and options.latency_histograms and runner is not None:
+        setup_latency_histograms(environment, runner, options.latency_histograms)
+
+@events.init.add_listener
+def on_arrival_rate_init(environment, runner=None, **kwargs):
+    """ Sets up the per-process arrival schedule when running the open model """
+    if not USES_COLLECTION or isinstance(runner, MasterRunner):
+        return
+    if ArrivalRateShape.abstract and not isinstance(runner, WorkerRunner):
+        return
+    schedule = environment.arrival_schedule = ArrivalSchedule()
+
+    def enable_arrival_mode():
+        TestUser.arrival_schedule = schedule
+        TestUser.wait_time = constant(0)
+
+    def on_arrival_rate(msg, **kwargs):
+        # Workers learn about the open model from the master, which sends the rate before spawning
+        enable_arrival_mode()
+        schedule.set_rate(msg.data)
+
+    if isinstance(runner, WorkerRunner):
+        runner.register_message('arrival_rate', on_arrival_rate)
+    else:
+        enable_arrival_mode()
+
+    @environment.events.test_start.add_listener
+    def on_arrival_test_start(environment, **kwargs):
+        if TestUser.arrival_schedule is schedule:
+            schedule.start()
+
+    @environment.events.test_stop.add_listener
+    def on_arrival_test_stop(environment, **kwargs):
+        schedule.stop()
+        schedule.print_summary()
+
+
+def setup_feeder(environment, path, mode, partition=''):
+    """ Opens the feeder for this process and splits its rows across workers at every test start """
+    feeder = environment.feeder = TestUser.feeder = Feeder(path, mode)
+    print(f"Feeder {path}: columns {', '.join(feeder.columns)} ({mode})")
+    runner = environment.runner
+    if partition and isinstance(runner, WorkerRunner):
+        # Fixed by the launcher, so a restarted worker reads the same rows again
+        index, count = (int(part) for part in partition.split('/'))
+        feeder.set_partition(index, count)
+        runner.register_message('feeder_partition', lambda msg, **kwargs: None)
+    elif isinstance(runner, MasterRunner):
+        partitioned = set()  # Workers that got their slice in this run
+
+        def send_partitions():
+            workers = sorted(runner.clients.values(), key=lambda worker: worker.id)
+            partitioned.clear()
+            for index, worker in enumerate(workers):
+                partitioned.add(worker.id)
+                runner.send_message('feeder_partition', [index, len(workers)], client_id=worker.id)
+
+        environment.events.test_start.add_listener(lambda **kwargs: send_partitions())
+
+        def on_feeder_join(msg, **kwargs):
+            # A worker joining a running test would otherwise read the whole file
+            if msg.node_id in partitioned:
+                return
+            if mode == 'unique':
+                # Splitting again would start every worker over at rows the others have already used
+                print(f"Feeder {path}: worker {msg.node_id} joined a running test and gets no rows (--feeder-mode unique)")
+                partitioned.add(msg.node_id)
+                runner.send_message('feeder_partition', [0, 0], client_id=msg.node_id)
+            else:
+                send_partitions()
+
+        runner.register_message('feeder_join', on_feeder_join)
+    elif isinstance(runner, WorkerRunner):
+        runner.register_message('feeder_partition', lambda msg, **kwargs: feeder.set_partition(*msg.data))
+        # The master ignores this from workers it already split the file for at test start
+        environment.events.test_start.add_listener(lambda **kwargs: runner.send_message('feeder_join'))
+        if runner.worker_state in (STATE_SPAWNING, STATE_RUNNING):
+            # Joined a running test, whose test_start may have fired before this listener was added
+            runner.send_message('feeder_join')
+    else:
+        environment.events.test_start.add_listener(lambda **kwargs: feeder.set_partition(0, 1))
+    return feeder
+
+
+@events.init.add_listener
+def on_request_plan_init(environment, **kwargs):
+    """ Compiles the collection once per process before any user is spawned """
+    if not USES_COLLECTION:
+        return
+    options = environment.parsed_options
+    namer = RequestNamer(options.request_name_mode, options.max_request_names) if options else None
+    feeder = None
+    if options and options.feeder:
+        feeder = setup_feeder(environment, options.feeder, options.feeder_mode, options.feeder_partition)
+    plan = get_request_plan(namer=namer, columns=feeder.columns if feeder else ())
+    TestUser.host = plan.base_url
+    if options:
+        TestUser.stream_responses = environment.parsed_options.response_mode == 'drain'
+        TestUser.failure_body_limit = environment.parsed_options.failure_body_limit
+        TestUser.task_order = environment.parsed_options.task_order
+    if not environment.host:
+        environment.host = plan.base_url
+    if isinstance(plan, CompiledPlan):
+        print(f"Loaded {len(plan.requests)} generated requests from {plan.path} ({CLIENT_BACKEND} backend)")
+    else:
+        print(f"Compiled {len(plan.requests)} requests from {plan.collection_file} ({CLIENT_BACKEND} backend)")
+    if options and (options.profile_phases or options.profile_sample):
+        profiler = setup_phase_profiler(environment, environment.runner, options.profile_sample)
+        # Generated task functions carry no timing, profiled runs use runtime tasks built from the same requests
+        plan.tasks = [make_task(compiled, profiler) for compiled in plan.requests]
+        plan.scenarios = make_scenarios(plan.requests, plan.tasks)
+        print("Phase profiler enabled")
+
+    error_aggregator = get_error_aggregator(environment)
+    runner = environment.runner
+    if not isinstance(runner, WorkerRunner):
+        # Workers ship their errors to the master, which prints the summary for the whole run
+        @environment.events.test_start.add_listener
+        def on_error_summary_test_start(environment, **kwargs):
+            if error_aggregator.print_on_quit:
+                # The previous run in the web UI, its workers have reported by now
+                error_aggregator.print_summary()
+                error_aggregator.print_on_quit = False
+            error_aggregator.entries = {}
+
+        @environment.events.test_stop.add_listener
+        def on_error_summary_test_stop(environment, **kwargs):
+            if isinstance(runner, MasterRunner) and runner.worker_count:
+                # quit() stops the master before the workers' final reports arrive, print on exit instead
+                error_aggregator.print_on_quit = True
+            else:
+                error_aggregator.print_summary()
+
+        @environment.events.quit.add_listener
+        def on_error_summary_quit(**kwargs):
+            if error_aggregator.print_on_quit:
+                error_aggregator.print_summary()
+                error_aggregator.print_on_quit = False
+
+    if isinstance(runner, MasterRunner):
+        def on_error_summary(msg, **kwargs):
+            error_aggregator.merge(msg.data)
+
+        @environment.events.worker_report.add_listener
+        def on_worker_report(client_id, data):
+            error_aggregator.merge(data.get('error_summary', ()))
+
+        runner.register_message('error_summary', on_error_summary)
+    elif isinstance(runner, WorkerRunner):
+        @environment.events.report_to_master.add_listener
+        def on_report_to_master(client_id, data):
+            data['error_summary'] = error_aggregator.pop_delta()
+
+        @environment.events.test_stop.add_listener
+        def on_worker_test_stop(environment, **kwargs):
+            # The last stats report may come after the master has already stopped
+            runner.send_message('error_summary', error_aggregator.pop_delta())
+
+# Prometheus metrics exporter
+RESPONSE_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 90.0)
+
+def escape_label(value, limit):
+    """ Escapes a Prometheus label value """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')[:limit]
+
+def summarize_response_times(entry):
+    """ Returns (p50, p95, p99, cumulative bucket counts) in seconds from one sorted pass over the entry """
+    # Same semantics as locust's calculate_response_time_percentile, which sorts once per percentile
+    num_requests = entry.num_requests - entry.num_none_requests
+    targets = [int(num_requests * percent) for percent in (0.5, 0.95, 0.99)]
+    percentiles = [0, 0, 0]
+    buckets = [0] * len(RESPONSE_TIME_BUCKETS)
+    below = 0
+    for response_time in sorted(entry.response_times):
+        for index, target in enumerate(targets):
+            if below <= target:
+                percentiles[index] = response_time
+        count = entry.response_times[response_time]
+        for index, bound in enumerate(RESPONSE_TIME_BUCKETS):
+            if response_time <= bound * 1000:
+                buckets[index] += count
+        below += count
+
+    # Like StatsEntry.median_response_time, keep the rounded median within min/max
+    if entry.response_times:
+        percentiles[0] = min(max(percentiles[0], entry.min_response_time or 0), entry.max_response_time)
+    return percentiles[0] / 1000.0, percentiles[1] / 1000.0, percentiles[2] / 1000.0, buckets
+
+class LoopLagMonitor:
+    """ Measures how late the gevent loop wakes a sleeping greenlet, which grows when the generator is CPU bound """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.max_lag = 0.0
+        self.greenlet = gevent.spawn(self.run)
+
+    def run(self):
+        while True:
+            started = time.perf_counter()
+            gevent.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def pop_max(self):
+        """ Returns the worst lag since the previous call """
+        max_lag, self.max_lag = self.max_lag, 0.0
+        return max_lag
+
+class PrometheusExporter:
+    """ Renders Locust stats in the Prometheus text format, re-rendering only entries that changed """
+    FAMILIES = (
+        ('locust_requests_total', 'counter', 'Total number of requests'),
+        ('locust_requests_failures_total', 'counter', 'Total number of failed requests'),
+        ('locust_response_time_seconds', 'summary', 'Response time in seconds'),
+        ('locust_response_time_median_seconds', 'gauge', 'Median response time in seconds'),
+        ('locust_response_time_p95_seconds', 'gauge', '95th percentile response time in seconds'),
+        ('locust_response_time_p99_seconds', 'gauge', '99th percentile response time in seconds'),
+        ('locust_response_time_histogram_seconds', 'histogram', 'Response time histogram in seconds'),
+    )
+    WORKER_FAMILIES = (
+        ('locust_worker_users', 'gauge', 'Users running on the worker'),
+        ('locust_worker_cpu_usage_percent', 'gauge', 'CPU usage of the worker process'),
+        ('locust_worker_memory_bytes', 'gauge', 'Resident memory of the worker process'),
+        ('locust_worker_loop_lag_seconds', 'gauge', 'Worst gevent loop lag in the last report interval'),
+        ('locust_worker_requests_total', 'counter', 'Requests made by the worker'),
+        ('locust_worker_failures_total', 'counter', 'Failed requests made by the worker'),
+    )
+
+    def __init__(self, environment, ttl=METRICS_CACHE_TTL):
+        self.environment = environment
+        self.ttl = ttl
+        self.rendered = None
+        self.rendered_at = 0.0
+        # stats key -> ((num_requests, num_failures), lines per family)
+        self.entry_cache = {}
+
+    def render(self):
+        """ Returns the exposition text, cached for `ttl` seconds """
+        now = time.monotonic()
+        if self.rendered is None or now - self.rendered_at >= self.ttl:
+            self.rendered = self.render_now()
+            self.rendered_at = now
+        return self.rendered
+
+    def render_entry(self, method, name, entry):
+        """ Renders one stats entry as a list of lines per family """
+        labels = f'method="{escape_label(method, 50)}",name="{escape_label(name, 200)}"'
+        requests_lines = [f'locust_requests_total{{{labels}}} {entry.num_requests}']
+        failures_lines = [f'locust_requests_failures_total{{{labels}}} {entry.num_failures}']
+        # Always export count, even if 0
+        summary_lines = [f'locust_response_time_seconds_count{{{labels}}} {entry.num_requests}']
+        median, p95, p99, buckets = 0, 0, 0, [0] * len(RESPONSE_TIME_BUCKETS)
+        if entry.num_requests > 0:
+            median, p95, p99, buckets = summarize_response_times(entry)
+            total_seconds = entry.total_response_time / 1000.0
+            summary_lines += [
+                f'locust_response_time_seconds{{{labels},quantile="0.5"}} {median}',
+                f'locust_response_time_seconds{{{labels},quantile="0.95"}} {p95}',
+                f'locust_response_time_seconds{{{labels},quantile="0.99"}} {p99}',
+                f'locust_response_time_seconds_sum{{{labels}}} {total_seconds}',
+            ]
+        histogram_lines = [
+            f'locust_response_time_histogram_seconds_bucket{{{labels},le="{bound}"}} {count}'
+            for bound, count in zip(RESPONSE_TIME_BUCKETS, buckets)
+        ]
+        histogram_lines += [
+            f'locust_response_time_histogram_seconds_bucket{{{labels},le="+Inf"}} {entry.num_requests}',
+            f'locust_response_time_histogram_seconds_sum{{{labels}}} {entry.total_response_time / 1000.0}',
+            f'locust_response_time_histogram_seconds_count{{{labels}}} {entry.num_requests}',
+        ]
+        return (
+            requests_lines,
+            failures_lines,
+            summary_lines,
+            [f'locust_response_time_median_seconds{{{labels}}} {median}'],
+            [f'locust_response_time_p95_seconds{{{labels}}} {p95}'],
+            [f'locust_response_time_p99_seconds{{{labels}}} {p99}'],
+            histogram_lines,
+        )
+
+    def render_now(self):
+        """ Renders the full exposition text """
+        stats = self.environment.stats
+        runner = self.environment.runner
+
         # Get current number of users from runner
         current_users = 0
         if runner and hasattr(runner, 'user_count'):
             current_users = runner.user_count
         elif runner and hasattr(runner, 'user_classes_count'):
             current_users = sum(runner.user_classes_count.values())
-        
-        metrics.append('# HELP locust_users_current Current number of users')
-        metrics.append('# TYPE locust_users_current gauge')
-        metrics.append(f'locust_users_current {current_users}')
-        
-        metrics.append('# HELP locust_users_total Total number of users')
-        metrics.append('# TYPE locust_users_total gauge')
-        metrics.append(f'locust_users_total {current_users}')
-        
-        metrics.append('# HELP locust_requests_total Total number of requests')
-        metrics.append('# TYPE locust_requests_total counter')
-        metrics.append(f'locust_requests_total{{method="",name="Total"}} {stats.total.num_requests}')
-        
-        metrics.append('# HELP locust_requests_failures_total Total number of failed requests')
-        metrics.append('# TYPE locust_requests_failures_total counter')
-        metrics.append(f'locust_requests_failures_total{{method="",name="Total"}} {stats.total.num_failures}')
-        
-        metrics.append('# HELP locust_response_time_seconds Response time in seconds')
-        metrics.append('# TYPE locust_response_time_seconds summary')
-        # Always export count, even if 0
-        metrics.append(f'locust_response_time_seconds_count{{method="",name="Total"}} {stats.total.num_requests}')
-        if stats.total.num_requests > 0:
-            try:
-                metrics.append(f'locust_response_time_seconds{{method="",name="Total",quantile="0.5"}} {stats.total.median_response_time / 1000.0}')
-                metrics.append(f'locust_response_time_seconds{{method="",name="Total",quantile="0.95"}} {stats.total.get_response_time_percentile(0.95) / 1000.0}')
-                metrics.append(f'locust_response_time_seconds{{method="",name="Total",quantile="0.99"}} {stats.total.get_response_time_percentile(0.99) / 1000.0}')
-                metrics.append(f'locust_response_time_seconds_sum{{method="",name="Total"}} {stats.total.total_response_time / 1000.0}')
-            except (AttributeError, ZeroDivisionError, TypeError):
-                pass
-        
-        # Also export as histogram for better Grafana compatibility
-        metrics.append('# HELP locust_response_time_median_seconds Median response time in seconds')
-        metrics.append('# TYPE locust_response_time_median_seconds gauge')
-        if stats.total.num_requests > 0:
-            try:
-                metrics.append(f'locust_response_time_median_seconds{{method="",name="Total"}} {stats.total.median_response_time / 1000.0}')
-            except (AttributeError, ZeroDivisionError):
-                metrics.append(f'locust_response_time_median_seconds{{method="",name="Total"}} 0')
-        else:
-            metrics.append(f'locust_response_time_median_seconds{{method="",name="Total"}} 0')
-        
-        metrics.append('# HELP locust_response_time_p95_seconds 95th percentile response time in seconds')
-        metrics.append('# TYPE locust_response_time_p95_seconds gauge')
-        if stats.total.num_requests > 0:
-            try:
-                metrics.append(f'locust_response_time_p95_seconds{{method="",name="Total"}} {stats.total.get_response_time_percentile(0.95) / 1000.0}')
-            except (AttributeError, ZeroDivisionError):
-                metrics.append(f'locust_response_time_p95_seconds{{method="",name="Total"}} 0')
-        else:
-            metrics.append(f'locust_response_time_p95_seconds{{method="",name="Total"}} 0')
-        
-        metrics.append('# HELP locust_response_time_p99_seconds 99th percentile response time in seconds')
-        metrics.append('# TYPE locust_response_time_p99_seconds gauge')
-        if stats.total.num_requests > 0:
-            try:
-                metrics.append(f'locust_response_time_p99_seconds{{method="",name="Total"}} {stats.total.get_response_time_percentile(0.99) / 1000.0}')
-            except (AttributeError, ZeroDivisionError):
-                metrics.append(f'locust_response_time_p99_seconds{{method="",name="Total"}} 0')
-        else:
-            metrics.append(f'locust_response_time_p99_seconds{{method="",name="Total"}} 0')
-        
-        metrics.append('# HELP locust_requests_per_second Requests per second')
-        metrics.append('# TYPE locust_requests_per_second gauge')
-        metrics.append(f'locust_requests_per_second {stats.total.total_rps}')
-        
-        # Add metrics for each endpoint
+
+        families = [self.render_entry('', 'Total', stats.total)]
+        entry_cache = {}
         for key, entry in stats.entries.items():
             # Handle both tuple (method, name) and string keys
             if isinstance(key, tuple):
-                method = key[0] or ""
-                name = key[1] or ""
+                name, method = key[0] or "", key[1] or ""
             else:
-                method = entry.method or ""
-                name = str(key)
-            
-            # Sanitize name for Prometheus labels
-            safe_name = str(name).replace('"', '\\"').replace('\n', '\\n').replace('\\', '\\\\')[:200]  # Limit length
-            safe_method = str(method).replace('"', '\\"').replace('\n', '\\n')[:50]
-            
-            metrics.append(f'locust_requests_total{{method="{safe_method}",name="{safe_name}"}} {entry.num_requests}')
-            metrics.append(f'locust_requests_failures_total{{method="{safe_method}",name="{safe_name}"}} {entry.num_failures}')
-            
-            # Always export count
-            metrics.append(f'locust_response_time_seconds_count{{method="{safe_method}",name="{safe_name}"}} {entry.num_requests}')
-            
-            if entry.num_requests > 0:
-                try:
-                    metrics.append(f'locust_response_time_seconds{{method="{safe_method}",name="{safe_name}",quantile="0.5"}} {entry.median_response_time / 1000.0}')
-                    metrics.append(f'locust_response_time_seconds{{method="{safe_method}",name="{safe_name}",quantile="0.95"}} {entry.get_response_time_percentile(0.95) / 1000.0}')
-                    metrics.append(f'locust_response_time_seconds{{method="{safe_method}",name="{safe_name}",quantile="0.99"}} {entry.get_response_time_percentile(0.99) / 1000.0}')
-                    metrics.append(f'locust_response_time_seconds_sum{{method="{safe_method}",name="{safe_name}"}} {entry.total_response_time / 1000.0}')
-                    
-                    # Also export as separate gauge metrics for easier querying
-                    metrics.append(f'locust_response_time_median_seconds{{method="{safe_method}",name="{safe_name}"}} {entry.median_response_time / 1000.0}')
-                    metrics.append(f'locust_response_time_p95_seconds{{method="{safe_method}",name="{safe_name}"}} {entry.get_response_time_percentile(0.95) / 1000.0}')
-                    metrics.append(f'locust_response_time_p99_seconds{{method="{safe_method}",name="{safe_name}"}} {entry.get_response_time_percentile(0.99) / 1000.0}')
-                except (AttributeError, ZeroDivisionError, TypeError):
-                    # Skip if response time data is not available
-                    metrics.append(f'locust_response_time_median_seconds{{method="{safe_method}",name="{safe_name}"}} 0')
-                    metrics.append(f'locust_response_time_p95_seconds{{method="{safe_method}",name="{safe_name}"}} 0')
-                    metrics.append(f'locust_response_time_p99_seconds{{method="{safe_method}",name="{safe_name}"}} 0')
-            else:
-                metrics.append(f'locust_response_time_median_seconds{{method="{safe_method}",name="{safe_name}"}} 0')
-                metrics.append(f'locust_response_time_p95_seconds{{method="{safe_method}",name="{safe_name}"}} 0')
-                metrics.append(f'locust_response_time_p99_seconds{{method="{safe_method}",name="{safe_name}"}} 0')
-        
+                name, method = str(key), entry.method or ""
+            version = (entry.num_requests, entry.num_failures)
+            cached = self.entry_cache.get(key)
+            lines = cached[1] if cached and cached[0] == version else self.render_entry(method, name, entry)
+            entry_cache[key] = (version, lines)
+            families.append(lines)
+        # Entries dropped by a stats reset fall out of the cache here
+        self.entry_cache = entry_cache
+
+        metrics = [
+            '# HELP locust_users_current Current number of users',
+            '# TYPE locust_users_current gauge',
+            f'locust_users_current {current_users}',
+            '# HELP locust_users_total Total number of users',
+            '# TYPE locust_users_total gauge',
+            f'locust_users_total {current_users}',
+        ]
+        # Prometheus expects the samples of a family to be contiguous
+        for index, (family, metric_type, description) in enumerate(self.FAMILIES):
+            metrics.append(f'# HELP {family} {description}')
+            metrics.append(f'# TYPE {family} {metric_type}')
+            for lines in families:
+                metrics.extend(lines[index])
+
+        metrics.append('# HELP locust_requests_per_second Requests per second')
+        metrics.append('# TYPE locust_requests_per_second gauge')
+        metrics.append(f'locust_requests_per_second {stats.total.total_rps}')
+
+        workers = self.collect_workers()
+        for index, (family, metric_type, description) in enumerate(self.WORKER_FAMILIES, 1):
+            metrics.append(f'# HELP {family} {description}')
+            metrics.append(f'# TYPE {family} {metric_type}')
+            for worker in workers:
+                if worker[index] is not None:
+                    metrics.append(f'{family}{{worker="{escape_label(worker[0], 100)}"}} {worker[index]}')
+
+        profiler = getattr(self.environment, 'phase_profiler', None)
+        if profiler:
+            metrics += profiler.render_metrics()
+
         return '\n'.join(metrics) + '\n'
-    
+
+    def collect_workers(self):
+        """ Returns (worker, users, cpu, memory, loop lag, requests, failures) rows, None where unknown """
+        runner = self.environment.runner
+        if isinstance(runner, MasterRunner):
+            worker_stats = getattr(self.environment, 'worker_stats', {})
+            live_workers = {worker.id: worker for worker in runner.clients.values()}
+            rows = []
+            for worker_id in sorted(set(worker_stats) | set(live_workers)):
+                stats = worker_stats.get(worker_id, {})
+                worker = live_workers.get(worker_id)
+                rows.append((
+                    worker_id,
+                    worker.user_count if worker else 0,
+                    worker.cpu_usage if worker else None,
+                    worker.memory_usage if worker else None,
+                    stats.get('loop_lag'),
+                    stats.get('requests', 0),
+                    stats.get('failures', 0),
+                ))
+            return rows
+        if runner is None:
+            return []
+        # Single process run, the local runner is the only load generator
+        monitor = getattr(self.environment, 'loop_lag_monitor', None)
+        total = self.environment.stats.total
+        return [(
+            'local',
+            runner.user_count,
+            runner.current_cpu_usage,
+            runner.current_memory_usage,
+            monitor.pop_max() if monitor else None,
+            total.num_requests,
+            total.num_failures,
+        )]
+
+@events.init.add_listener
+def on_generator_metrics_init(environment, runner=None, **kwargs):
+    """ Tracks the health of every load generator process for /metrics """
+    if isinstance(runner, MasterRunner):
+        worker_stats = environment.worker_stats = {}
+
+        @environment.events.worker_report.add_listener
+        def on_worker_report(client_id, data):
+            stats = worker_stats.setdefault(client_id, {'requests': 0, 'failures': 0, 'loop_lag': 0.0})
+            # stats_total holds only what happened since the worker's previous report
+            stats_total = data.get('stats_total') or {}
+            stats['requests'] += stats_total.get('num_requests', 0)
+            stats['failures'] += stats_total.get('num_failures', 0)
+            stats['loop_lag'] = data.get('loop_lag', 0.0)
+    elif runner is not None:
+        monitor = environment.loop_lag_monitor = LoopLagMonitor()
+        if isinstance(runner, WorkerRunner):
+            @environment.events.report_to_master.add_listener
+            def on_report_to_master(client_id, data):
+                data['loop_lag'] = monitor.pop_max()
+
+@events.init.add_listener
+def on_locust_init(environment, web_ui=None, **kwargs):
+    """Add Prometheus metrics endpoint to Locust web UI"""
+    # Workers and headless runs have no web UI to attach to
+    if not web_ui:
+        return
+    exporter = environment.prometheus_exporter = PrometheusExporter(environment)
+
     def prometheus_metrics():
         """Handler for /metrics endpoint"""
         try:
-            metrics_data = metrics_handler()
             return Response(
-                metrics_data,
+                exporter.render(),
                 mimetype='text/plain; version=0.0.4; charset=utf-8'
             )
         except Exception as e:
             return Response(f'Error generating metrics: {str(e)}', status=500)
-    
-    # Add /metrics endpoint to Locust web UI when it's available
-    def setup_metrics_endpoint():
-        if hasattr(environment, 'web_ui') and environment.web_ui and hasattr(environment.web_ui, 'app'):
-            environment.web_ui.app.add_url_rule('/metrics', 'metrics', prometheus_metrics, methods=['GET'])
-            print("Prometheus metrics exporter enabled at http://localhost:8089/metrics")
-        else:
-            # Retry after a short delay if web_ui is not ready yet
-            threading.Timer(1.0, setup_metrics_endpoint).start()
-    
-    setup_metrics_endpoint()
\ No newline at end of file
+
+    web_ui.app.add_url_rule('/metrics', 'metrics', prometheus_metrics, methods=['GET'])
+    print("Prometheus metrics exporter enabled at http://localhost:8089/metrics")
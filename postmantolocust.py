@@ -0,0 +1,604 @@
+""" PostmanToLocust command line tools
+
+    python postmantolocust.py compile [collection] [--request-name-mode path] [--max-request-names 200] [--feeder rows.csv]
+    python postmantolocust.py bench [--users 200] [--duration 30] [--latency-ms 20] [--save-baseline]
+    python postmantolocust.py mock-server [--port 8900] [--latency-ms 20] [--payload-bytes 2048] [--error-rate 0]
+    python postmantolocust.py launch [--workers N] [locust options, e.g. --headless -u 1000 -r 100 -t 10m]
+    python postmantolocust.py compare baseline_histograms.json new_histograms.json [--threshold 0.1]
+    python postmantolocust.py request-log Locust_Report/requests.bin [more files] [--output requests.jsonl]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unicodedata
+
+import gevent
+import psutil
+from gevent.pywsgi import WSGIServer
+
+from locustfile import (COLLECTION_FILE_NAME, MAX_REQUEST_NAMES, CompiledPlan, Feeder, RequestNamer, RequestPlan,
+                        TextTemplate, compiled_module_path, config, latency_at_rank, load_latency_histograms,
+                        read_request_log)
+
+# Generator benchmark
+BENCH_BASELINE_FILE = 'bench_baseline.json'
+BENCH_REPORT_FILE = 'Locust_Report/bench_result.json'
+BENCH_TOLERANCE = 0.15  # Relative slack before a metric counts as a regression
+BENCH_METRICS = {  # Metric compared against the baseline: True when higher is better
+    'rps_per_core': True,
+    'cpu_ms_per_request': False,
+    'rss_mb_per_1000_users': False,
+    'spawn_seconds': False,
+}
+MOCK_SERVER_START_TIMEOUT = 10
+
+# Multi-core launcher
+LAUNCH_POLL_INTERVAL = 1.0  # Seconds between checks of the worker processes
+LAUNCH_MAX_RESTARTS = 5  # Restarts of one crashed worker before it is left down
+LAUNCH_CPU_WARNING = 90.0  # Percent of one core a worker may use before it counts as pegged
+LAUNCH_CPU_WARNING_SECONDS = 10  # Seconds a worker has to stay pegged before the warning
+LAUNCH_STOP_TIMEOUT = 10  # Seconds processes get to exit before they are killed
+
+# Run-over-run comparison of --latency-histograms files
+COMPARE_QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('p99.9', 0.999))
+COMPARE_THRESHOLD = 0.10  # Relative change a regression must also exceed to be reported
+COMPARE_Z = 2.576  # 99% confidence
+COMPARE_MIN_SAMPLES = 20  # Requests an endpoint needs in both runs to be judged
+COMPARE_TAIL_SAMPLES = 10  # Samples above a quantile both runs need before it is judged, p99.9 needs 10000 requests
+
+# Turkish letters NFKD does not decompose to ASCII
+IDENTIFIER_TRANSLATION = str.maketrans('ıİğĞşŞçÇöÖüÜ', 'iIgGsScCoOuU')
+MAX_IDENTIFIER_LENGTH = 60
+
+
+def identifier(text, fallback='request'):
+    """ Turns a Postman folder or request name into a lowercase Python identifier """
+    text = unicodedata.normalize('NFKD', text.translate(IDENTIFIER_TRANSLATION))
+    slug = re.sub(r'\W+', '_', text.encode('ascii', 'ignore').decode('ascii')).strip('_').lower()
+    slug = slug[:MAX_IDENTIFIER_LENGTH].rstrip('_')
+    if not slug or slug[0].isdigit():
+        slug = f"{fallback}_{slug}".rstrip('_')
+    return slug
+
+def unique(name, used):
+    """ Appends a counter to name until it is not in used """
+    candidate = name
+    counter = 2
+    while candidate in used:
+        candidate = f"{name}_{counter}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+def generate_module(plan, source):
+    """ Renders a plan as Python source: constants and one plain task function per request """
+    lines = [
+        f'""" Generated by `python postmantolocust.py compile` from {plan.collection_file}, do not edit',
+        '',
+        '    Recompile instead; the file name carries the collection content hash.',
+        '"""',
+        'from locustfile import (BodyTemplate, CompiledRequest, Extraction, FolderScenario, FolderTaskSet, ResponseCheck,',
+        '                        ResponseChecks, TextTemplate, fill_headers, handle_response, schedule_lag)',
+        '',
+        f'SOURCE = {source!r}',
+        f'BASE_URL = {plan.base_url!r}',
+        '# Defaults of the variables test scripts extract, copied into each user',
+        f'VARIABLES = {plan.variables!r}',
+        '# Compile errors and untranslated test scripts, printed when the module is loaded',
+        f'LOAD_ERRORS = {sorted(plan.load_errors)!r}',
+    ]
+    used_functions = set()
+    folders = {}
+    requests = []
+    for index, compiled in enumerate(plan.requests):
+        function = unique(identifier(compiled.key), used_functions)
+        folders.setdefault(compiled.folder or 'Unknown', []).append(function)
+        method = compiled.method
+        lines += [
+            '',
+            '',
+            f'# {compiled.key}',
+            f'URL_{index} = {compiled.url!r}',
+            f'NAME_{index} = {compiled.name!r}',
+            f'HEADERS_{index} = {compiled.headers!r}',
+        ]
+        row = 'row' if compiled.fed or compiled.chained else ''
+        body = compiled.body
+        if body is None:
+            lines.append(f'BODY_{index} = None')
+            data = 'None'
+        elif body.static is not None:
+            lines += [
+                f'DATA_{index} = {body.static!r}',
+                f'BODY_{index} = BodyTemplate((DATA_{index},), (), {body.content_type!r})',
+            ]
+            data = f'DATA_{index}'
+        else:
+            lines.append(f'BODY_{index} = {body!r}')
+            data = f'BODY_{index}.render({row})'
+        if compiled.checks:
+            lines += [f'CHECKS_{index} = ResponseChecks((', *(f'    {check!r},' for check in compiled.checks.checks)]
+            if compiled.checks.extractions:
+                lines += ['), (', *(f'    {extraction!r},' for extraction in compiled.checks.extractions)]
+            lines.append('))')
+        else:
+            lines.append(f'CHECKS_{index} = None')
+        # Body assertions need the body buffered, whatever the response mode
+        stream = 'False' if compiled.checks and compiled.checks.needs_body else 'user.stream_responses'
+        url = f'URL_{index}.render(row)' if isinstance(compiled.url, TextTemplate) else f'URL_{index}'
+        headers = f'HEADERS_{index}'
+        if any(isinstance(value, TextTemplate) for value in compiled.headers.values()):
+            headers = f'fill_headers(HEADERS_{index}, row)'
+        requests.append(f'    CompiledRequest({compiled.key!r}, {compiled.folder!r}, {method!r}, URL_{index}, '
+                        f'NAME_{index}, HEADERS_{index}, BODY_{index}, {compiled.fed!r}, CHECKS_{index}, '
+                        f'{compiled.chained!r}),')
+        lines += ['', '', f'def {function}(user):']
+        if compiled.fed and compiled.chained:
+            lines.append('    row = {**user.variables, **user.feeder.next_row()}')
+        elif compiled.fed:
+            lines.append('    row = user.feeder.next_row()')
+        elif compiled.chained:
+            lines.append('    row = user.variables')
+        lines += [
+            '    lag = schedule_lag(user)',
+            f'    with user.client.{method}({url}, headers={headers}, data={data}, name=NAME_{index},',
+            f'    {" " * len(f"with user.client.{method}(")}stream={stream}, catch_response=True) as response:',
+            f'        handle_response(user, response, {method.upper()!r}, NAME_{index}, lag, CHECKS_{index})',
+        ]
+
+    lines += ['', '', 'REQUESTS = (', *requests, ')', '']
+    lines.append('# Users pick uniformly among all requests, like the runtime plan')
+    lines += ['TASKS = [', *(f'    {function},' for functions in folders.values() for function in functions), ']']
+
+    used_classes = set()
+    folder_classes = {}
+    for folder, functions in folders.items():
+        class_name = unique(''.join(part.capitalize() for part in identifier(folder, 'folder').split('_')) + 'Tasks',
+                            used_classes)
+        folder_classes[folder] = class_name
+        lines += [
+            '',
+            '',
+            f'class {class_name}(FolderTaskSet):',
+            f'    """ {folder}: {len(functions)} requests """',
+            '    tasks = {',
+            *(f'        {function}: 1,' for function in functions),
+            '    }',
+        ]
+
+    lines += ['', '', '# Folder TaskSets, e.g. TestUser.tasks = {FOLDERS["Bus"]: 1} to load a single folder',
+              'FOLDERS = {', *(f'    {folder!r}: {name},' for folder, name in folder_classes.items()), '}']
+
+    scenario_classes = []
+    for folder, functions in folders.items():
+        class_name = unique(folder_classes[folder][:-len('Tasks')] + 'Scenario', used_classes)
+        scenario_classes.append(class_name)
+        lines += [
+            '',
+            '',
+            f'class {class_name}(FolderScenario):',
+            f'    """ {folder} in collection order, for --task-order sequential """',
+            f'    folder = {folder!r}',
+            '    tasks = [',
+            *(f'        {function},' for function in functions),
+            '    ]',
+        ]
+    lines += ['', '', 'SCENARIOS = [', *(f'    {name},' for name in scenario_classes), ']', '']
+    return '\n'.join(lines)
+
+def compile_collection(collection_file, name_mode, max_names, columns=(), force=False):
+    """ Writes the generated module for a collection unless an up to date one is cached, returns its path """
+    namer = RequestNamer(name_mode, max_names)
+    path = compiled_module_path(collection_file, namer, columns)
+    if os.path.exists(path) and not force:
+        return path, False
+
+    plan = RequestPlan(collection_file, namer, columns)
+    source = generate_module(plan, os.path.basename(path))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Workers may compile the same collection at once, replace atomically
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(source)
+    os.replace(temporary_path, path)
+    return path, True
+
+def command_compile(args):
+    columns = Feeder(args.feeder).columns if args.feeder else ()
+    path, written = compile_collection(args.collection, args.request_name_mode, args.max_request_names, columns,
+                                       args.force)
+    # A fresh compile has printed its errors already
+    plan = CompiledPlan(args.collection, path, report_errors=not written)
+    state = "Generated" if written else "Up to date"
+    print(f"{state}: {path} ({len(plan.requests)} requests, {len(plan.folders)} folders)")
+    return 0
+
+def mock_application(latency, payload_bytes, error_rate):
+    """ WSGI app answering every request with a JSON body of payload_bytes after latency seconds """
+    envelope = b'{"ok": true, "data": ""}'
+    body = envelope[:-2] + b'x' * max(payload_bytes - len(envelope), 0) + envelope[-2:]
+    error_body = b'{"error": "mock failure"}'
+
+    def application(environ, start_response):
+        environ['wsgi.input'].read()
+        if latency:
+            gevent.sleep(latency)
+        if error_rate and random.random() < error_rate:
+            status, response = '500 Internal Server Error', error_body
+        else:
+            status, response = '200 OK', body
+        start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(response)))])
+        return [response]
+
+    return application
+
+def command_mock_server(args):
+    application = mock_application(args.latency_ms / 1000, args.payload_bytes, args.error_rate)
+    print(f"Mock server on http://127.0.0.1:{args.port} ({args.latency_ms} ms, {args.payload_bytes} bytes, "
+          f"{args.error_rate:.1%} errors)", flush=True)
+    WSGIServer(('127.0.0.1', args.port), application, log=None).serve_forever()
+    return 0
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=MOCK_SERVER_START_TIMEOUT):
+    """ Waits until something accepts connections on port, False on timeout """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def bench_key(args):
+    """ Baselines are only comparable for the same load, one is kept per setting combination """
+    return (f"{args.client_backend}-u{args.users}-{args.latency_ms}ms-{args.payload_bytes}b-"
+            f"{args.error_rate:g}e")
+
+def compare_to_baseline(result, baseline, tolerance):
+    """ Returns a line per metric and whether any of them regressed beyond tolerance """
+    lines = []
+    regressed = False
+    for metric, higher_is_better in BENCH_METRICS.items():
+        value, reference = result.get(metric), baseline.get(metric)
+        if value is None or not reference:
+            continue
+        change = (value - reference) / reference
+        worse = -change if higher_is_better else change
+        status = 'REGRESSED' if worse > tolerance else 'ok'
+        regressed = regressed or worse > tolerance
+        lines.append(f"  {metric:<24}{value:>12}  baseline {reference:>12}  {change:+.1%}  {status}")
+    return lines, regressed
+
+def command_bench(args):
+    root = os.path.dirname(os.path.abspath(__file__))
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'mock-server', '--port', str(port),
+                               '--latency-ms', str(args.latency_ms), '--payload-bytes', str(args.payload_bytes),
+                               '--error-rate', str(args.error_rate)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    report_path = os.path.join(root, BENCH_REPORT_FILE)
+    try:
+        if not wait_for_port(port):
+            print("Mock server did not start")
+            return 2
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        command = [sys.executable, '-m', 'locust', '-f', os.path.join(root, 'locustfile.py'), '--headless',
+                   '--only-summary', '--csv=', '-u', str(args.users), '-r', str(args.spawn_rate or args.users),
+                   '-t', f"{args.duration}s", '--host', f"http://127.0.0.1:{port}", '--test-type', 'api',
+                   '--client-backend', args.client_backend, '--bench-report', report_path]
+        print(f"Bench {bench_key(args)}: {args.users} users for {args.duration}s against the mock server")
+        with tempfile.TemporaryFile() as output:
+            # Exit code 1 only means some requests failed, which --error-rate asks for
+            code = subprocess.call(command, cwd=root, stdout=output, stderr=subprocess.STDOUT)
+            if code not in (0, 1) or not os.path.exists(report_path):
+                output.seek(0)
+                print(output.read().decode('utf-8', errors='replace')[-4000:])
+                print(f"locust exited with {code} and wrote no bench report")
+                return 2
+    finally:
+        server.terminate()
+        server.wait()
+
+    with open(report_path, encoding='utf-8') as f:
+        result = json.load(f)
+    for metric, value in result.items():
+        print(f"  {metric:<24}{value}")
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f)
+    key = bench_key(args)
+    if args.save_baseline:
+        baselines[key] = result
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baseline {key} saved to {args.baseline}")
+        return 0
+    if key not in baselines:
+        print(f"No baseline for {key} in {args.baseline}, record one with --save-baseline")
+        return 0
+    lines, regressed = compare_to_baseline(result, baselines[key], args.tolerance)
+    print(f"Compared to {args.baseline} ({key}):")
+    print('\n'.join(lines))
+    return 1 if regressed else 0
+
+
+def launch_cpus():
+    """ CPUs this process may run on, in order """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def start_locust(root, arguments, cpu=None):
+    """ Starts a locust process, pinned to one CPU where the platform allows it """
+    pin = None
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        pin = lambda: os.sched_setaffinity(0, {cpu})
+    return subprocess.Popen([sys.executable, '-m', 'locust', '-f', os.path.join(root, 'locustfile.py')] + arguments,
+                            preexec_fn=pin)
+
+def stop_processes(processes, timeout=LAUNCH_STOP_TIMEOUT):
+    """ Terminates the processes still running, killing those that do not exit in time """
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def command_launch(args):
+    root = os.path.dirname(os.path.abspath(__file__))
+    # Options the plan depends on, everything else goes to locust unchanged
+    plan_parser = argparse.ArgumentParser(add_help=False)
+    plan_parser.add_argument('--request-name-mode', default='path')
+    plan_parser.add_argument('--max-request-names', type=int, default=MAX_REQUEST_NAMES)
+    plan_parser.add_argument('--feeder', default='')
+    plan_parser.add_argument('--feeder-mode', default='sequential')
+    plan_options, _ = plan_parser.parse_known_args(args.locust_args)
+
+    # Parse the collection once, workers import the generated module (and its cached bytecode) instead
+    started = time.monotonic()
+    columns = Feeder(plan_options.feeder).columns if plan_options.feeder else ()
+    path, written = compile_collection(COLLECTION_FILE_NAME, plan_options.request_name_mode,
+                                       plan_options.max_request_names, columns)
+    plan = CompiledPlan(COLLECTION_FILE_NAME, path, report_errors=not written)
+    print(f"{'Generated' if written else 'Up to date'}: {path} ({len(plan.requests)} requests) "
+          f"in {time.monotonic() - started:.1f}s")
+
+    cpus = launch_cpus()
+    workers = args.workers or max(1, len(cpus) - 1)
+    host = args.master_host or get_launch_setting('master-bind-host', '127.0.0.1')
+    port = str(args.master_port or get_launch_setting('master-bind-port', '5557'))
+    print(f"Launching a master and {workers} workers on {len(cpus)} CPUs")
+
+    # The master only aggregates, it shares the first CPU; workers get one each while there are enough
+    # Rebalancing hands the users of a crashed worker to the others, and to its replacement once it is back
+    master = start_locust(root, ['--master', '--expect-workers', str(workers), '--master-bind-host', host,
+                                 '--master-bind-port', port, '--enable-rebalancing'] + args.locust_args,
+                          cpus[0] if len(cpus) > 1 else None)
+
+    def start_worker(index):
+        arguments = ['--worker', '--master-host', host, '--master-port', port]
+        if plan_options.feeder:
+            arguments += ['--feeder-partition', f"{index}/{workers}"]
+        cpu = cpus[1 + index % (len(cpus) - 1)] if len(cpus) > 1 else None
+        process = start_locust(root, arguments + args.locust_args, cpu)
+        return {'index': index, 'process': process, 'monitor': psutil.Process(process.pid), 'restarts': 0,
+                'busy_since': None, 'warned': False}
+
+    pool = [start_worker(index) for index in range(workers)]
+    for worker in pool:
+        worker['monitor'].cpu_percent(None)
+    try:
+        while master.poll() is None:
+            time.sleep(LAUNCH_POLL_INTERVAL)
+            for worker in pool:
+                process = worker['process']
+                code = process.poll()
+                if code is None:
+                    check_worker_cpu(worker)
+                elif code != 0 and master.poll() is None:
+                    if worker['restarts'] >= LAUNCH_MAX_RESTARTS:
+                        continue
+                    if plan_options.feeder and plan_options.feeder_mode == 'unique':
+                        # A replacement would read its slice from the start again and reuse consumed rows
+                        print(f"Worker {worker['index']} exited with code {code}, not restarted: "
+                              f"--feeder-mode unique rows of its slice may already be used")
+                        worker['restarts'] = LAUNCH_MAX_RESTARTS
+                        continue
+                    print(f"Worker {worker['index']} exited with code {code}, restarting it")
+                    restarts = worker['restarts'] + 1
+                    worker.update(start_worker(worker['index']))
+                    worker['restarts'] = restarts
+                    worker['monitor'].cpu_percent(None)
+                    if restarts == LAUNCH_MAX_RESTARTS:
+                        print(f"Worker {worker['index']} restarted {restarts} times, it will not be restarted again")
+    except KeyboardInterrupt:
+        print("Stopping the master and the workers")
+    finally:
+        # The master's stats are final once it exits, a terminated master still writes its reports
+        stop_processes([master])
+        stop_processes([worker['process'] for worker in pool])
+    return master.returncode
+
+def check_worker_cpu(worker):
+    """ Warns once per episode when a worker stays pegged, its users then wait on the CPU rather than the server """
+    try:
+        usage = worker['monitor'].cpu_percent(None)
+    except psutil.Error:
+        return
+    if usage < LAUNCH_CPU_WARNING:
+        worker['busy_since'] = None
+        worker['warned'] = False
+        return
+    if worker['busy_since'] is None:
+        worker['busy_since'] = time.monotonic()
+    elif not worker['warned'] and time.monotonic() - worker['busy_since'] >= LAUNCH_CPU_WARNING_SECONDS:
+        worker['warned'] = True
+        print(f"Warning: worker {worker['index']} (pid {worker['process'].pid}) has used {usage:.0f}% CPU for "
+              f"{LAUNCH_CPU_WARNING_SECONDS}s, response times include client-side queueing; add workers or lower -u")
+
+def get_launch_setting(name, default):
+    """ Reads a [loadtest] value from locust.conf """
+    return config.get('loadtest', name, fallback=default).split(';')[0].strip()
+
+def quantile_interval(entry, quantile):
+    """ Returns (low, value, high) latency in ms of a quantile, low and high bound its COMPARE_Z confidence interval """
+    # The rank of a sample quantile is binomially distributed around count * quantile
+    count = entry['count']
+    rank = quantile * count
+    spread = COMPARE_Z * (count * quantile * (1 - quantile)) ** 0.5
+    buckets = entry['buckets']
+    return (latency_at_rank(buckets, max(0, int(rank - spread))), latency_at_rank(buckets, min(count - 1, int(rank))),
+            latency_at_rank(buckets, min(count - 1, int(rank + spread) + 1)))
+
+
+def compare_runs(baseline, result, threshold):
+    """ Returns a line per endpoint and metric, and whether any of them is a significant regression """
+    (base_duration, base_entries), (duration, entries) = baseline, result
+    lines = []
+    regressed = False
+    for key in sorted(base_entries.keys() | entries.keys()):
+        if key not in entries or key not in base_entries:
+            lines.append(f"{key}\n  only in the {'baseline' if key in base_entries else 'new run'}")
+            continue
+        base, new = base_entries[key], entries[key]
+        if min(base['count'], new['count']) < COMPARE_MIN_SAMPLES:
+            lines.append(f"{key}\n  too few requests to compare ({base['count']} vs {new['count']})")
+            continue
+        lines.append(key)
+        for label, quantile in COMPARE_QUANTILES:
+            base_low, base_value, base_high = quantile_interval(base, quantile)
+            low, value, high = quantile_interval(new, quantile)
+            change = (value - base_value) / base_value if base_value else 0.0
+            # Slower beyond the threshold, and the confidence intervals do not overlap
+            worse = change > threshold and low > base_high
+            better = change < -threshold and high < base_low
+            status = 'REGRESSED' if worse else 'improved' if better else 'ok'
+            if min(base['count'], new['count']) * (1 - quantile) < COMPARE_TAIL_SAMPLES:
+                # The normal approximation of the rank fails in a tail this thin
+                worse = False
+                status = 'too few samples'
+            regressed = regressed or worse
+            lines.append(f"  {label:<8}{value:>12.2f} ms  baseline {base_value:>12.2f} ms  {change:+8.1%}  {status}")
+        # Request counts are Poisson, the variance of a rate is count / duration**2
+        base_rate, rate = base['count'] / base_duration, new['count'] / duration
+        spread = COMPARE_Z * (base['count'] / base_duration ** 2 + new['count'] / duration ** 2) ** 0.5
+        change = (rate - base_rate) / base_rate
+        worse = change < -threshold and base_rate - rate > spread
+        better = change > threshold and rate - base_rate > spread
+        status = 'REGRESSED' if worse else 'improved' if better else 'ok'
+        regressed = regressed or worse
+        lines.append(f"  {'req/s':<8}{rate:>12.2f}     baseline {base_rate:>12.2f}     {change:+8.1%}  {status}")
+    return lines, regressed
+
+def command_compare(args):
+    try:
+        baseline, result = load_latency_histograms(args.baseline), load_latency_histograms(args.result)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Cannot compare: {e}")
+        return 2
+    lines, regressed = compare_runs(baseline, result, args.threshold)
+    print(f"{args.result} compared to {args.baseline}:")
+    print('\n'.join(lines))
+    if regressed:
+        print("Significant regressions found")
+    return 1 if regressed else 0
+
+
+def command_request_log(args):
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    count = 0
+    try:
+        for path in args.files:
+            for record in read_request_log(path):
+                output.write(json.dumps(record) + '\n')
+                count += 1
+    finally:
+        if args.output:
+            output.close()
+            print(f"{count} records written to {args.output}")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='postmantolocust')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = commands.add_parser('compile', help="Generate a static task module from a Postman collection")
+    compile_parser.add_argument('collection', nargs='?', default=COLLECTION_FILE_NAME)
+    compile_parser.add_argument('--request-name-mode', choices=['path', 'template', 'item'], default='path',
+                                help="Must match the --request-name-mode the test runs with")
+    compile_parser.add_argument('--max-request-names', type=int, default=MAX_REQUEST_NAMES)
+    compile_parser.add_argument('--feeder', default='',
+                                help="Feeder file the test runs with, its columns become send-time slots")
+    compile_parser.add_argument('--force', action='store_true', help="Regenerate even if a cached module exists")
+    compile_parser.set_defaults(handler=command_compile)
+
+    bench_parser = commands.add_parser('bench', help="Measure the load generator against a local mock server")
+    bench_parser.add_argument('--users', type=int, default=200, help="Concurrent users, each with one request in flight")
+    bench_parser.add_argument('--spawn-rate', type=float, default=0, help="Users started per second, default all at once")
+    bench_parser.add_argument('--duration', type=int, default=30, help="Seconds measured after spawning")
+    bench_parser.add_argument('--client-backend', choices=['requests', 'fast'], default='fast')
+    bench_parser.add_argument('--latency-ms', type=int, default=20)
+    bench_parser.add_argument('--payload-bytes', type=int, default=2048)
+    bench_parser.add_argument('--error-rate', type=float, default=0.0)
+    bench_parser.add_argument('--baseline', default=BENCH_BASELINE_FILE)
+    bench_parser.add_argument('--save-baseline', action='store_true', help="Store this run as the baseline")
+    bench_parser.add_argument('--tolerance', type=float, default=BENCH_TOLERANCE)
+    bench_parser.set_defaults(handler=command_bench)
+
+    server_parser = commands.add_parser('mock-server', help="Stand-in server answering every request with JSON")
+    server_parser.add_argument('--port', type=int, default=8900)
+    server_parser.add_argument('--latency-ms', type=int, default=20)
+    server_parser.add_argument('--payload-bytes', type=int, default=2048)
+    server_parser.add_argument('--error-rate', type=float, default=0.0)
+    server_parser.set_defaults(handler=command_mock_server)
+
+    launch_parser = commands.add_parser(
+        'launch', help="Run a master and one worker per CPU on this machine, other options are passed to locust")
+    launch_parser.add_argument('--workers', type=int, default=0, help="Worker processes, default one per CPU but one")
+    launch_parser.add_argument('--master-host', default='', help="Default: master-bind-host of [loadtest] in locust.conf")
+    launch_parser.add_argument('--master-port', type=int, default=0,
+                               help="Default: master-bind-port of [loadtest] in locust.conf")
+    launch_parser.set_defaults(handler=command_launch)
+
+    compare_parser = commands.add_parser('compare', help="Diff two --latency-histograms runs per endpoint")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('result')
+    compare_parser.add_argument('--threshold', type=float, default=COMPARE_THRESHOLD,
+                                help="Relative slowdown a significant change must exceed to count as a regression")
+    compare_parser.set_defaults(handler=command_compare)
+
+    log_parser = commands.add_parser('request-log', help="Export --request-log files as JSON lines")
+    log_parser.add_argument('files', nargs='+', help="Request logs, e.g. one per worker")
+    log_parser.add_argument('--output', '-o', default='', help="JSONL file to write, default standard output")
+    log_parser.set_defaults(handler=command_request_log)
+
+    args, locust_args = parser.parse_known_args(argv)
+    if locust_args and args.command != 'launch':
+        parser.error(f"unrecognized arguments: {' '.join(locust_args)}")
+    args.locust_args = locust_args
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())